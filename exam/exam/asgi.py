@@ -0,0 +1,24 @@
+"""
+ASGI config for exam project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+e.g. ``uvicorn exam.asgi:application`` or ``daphne exam.asgi:application``.
+
+Django 2.2 has no ASGI handler, so the WSGI application runs in the thread
+pool of asgiref's ``WsgiToAsgi`` adapter (``pip install asgiref``). Django 3.0
+and newer serve ASGI natively.
+"""
+
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'exam.settings')
+
+try:
+    from django.core.asgi import get_asgi_application
+except ImportError:
+    from asgiref.wsgi import WsgiToAsgi
+    from django.core.wsgi import get_wsgi_application
+
+    application = WsgiToAsgi(get_wsgi_application())
+else:
+    application = get_asgi_application()
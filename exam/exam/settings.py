@@ -56,6 +56,7 @@ ACCOUNT_LOGOUT_ON_GET = True
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
 MIDDLEWARE = [
+    'sheets.instrumentation.QueryInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -99,6 +100,68 @@ DATABASES = {
     }
 }
 
+# Production profile: a server database with persistent connections and optional read replicas, e.g.
+# SHEETS_DB_ENGINE=django.db.backends.postgresql SHEETS_DB_HOST=primary SHEETS_DB_REPLICA_HOSTS=replica1,replica2
+if os.environ.get('SHEETS_DB_ENGINE'):
+    DATABASES['default'] = {
+        'ENGINE': os.environ['SHEETS_DB_ENGINE'],
+        'NAME': os.environ.get('SHEETS_DB_NAME', 'exam'),
+        'USER': os.environ.get('SHEETS_DB_USER', ''),
+        'PASSWORD': os.environ.get('SHEETS_DB_PASSWORD', ''),
+        'HOST': os.environ.get('SHEETS_DB_HOST', ''),
+        'PORT': os.environ.get('SHEETS_DB_PORT', ''),
+        'CONN_MAX_AGE': int(os.environ.get('SHEETS_DB_CONN_MAX_AGE', 60)),
+    }
+    for index, host in enumerate(filter(None, os.environ.get('SHEETS_DB_REPLICA_HOSTS', '').split(','))):
+        DATABASES[f'replica_{index}'] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+
+# Reads of read-only viewset actions go to replicas, see sheets.db
+DATABASE_ROUTERS = ['sheets.db.ReadReplicaRouter']
+
+# Seconds a replica that refused connections is skipped
+SHEETS_REPLICA_RETRY = 30
+
+# Check persistent connections at the start of each request and drop the broken ones
+SHEETS_DB_HEALTH_CHECKS = DATABASES['default'].get('CONN_MAX_AGE', 0) != 0
+
+# Pragmas profile of sheets.db.SQLITE_PRAGMAS run on every new SQLite connection, WAL lets readers work alongside
+# a writer. SHEETS_SQLITE_TUNING=1 opts into the tuned profile for single node deployments.
+SHEETS_SQLITE_PRAGMAS = 'tuned' if os.environ.get('SHEETS_SQLITE_TUNING') else 'wal'
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sheets': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sheets',
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+            'CULL_FREQUENCY': 3,
+        },
+    },
+}
+
+# Cache alias used for rendered template exam sheets and statistics, a shared backend lets processes reuse
+# each other's renders (cached renders are checked against the database on every read)
+SHEETS_CACHE = 'sheets'
+
+# Strategies grading text answers, a solution picks one by name in `grading`
+SHEETS_GRADING_STRATEGIES = {
+    'exact': 'sheets.grading.ExactMatcher',
+    'normalized': 'sheets.grading.NormalizedMatcher',
+    'token_set': 'sheets.grading.TokenSetMatcher',
+    'regex': 'sheets.grading.RegexMatcher',
+}
+SHEETS_DEFAULT_GRADING = 'exact'
+
+# Render serializers through precomputed field getters instead of DRF's per field resolution
+SHEETS_FAST_REPRESENTATION = True
+
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
 
@@ -132,6 +195,39 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'sheets.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_PARSER_CLASSES': (
+        'sheets.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
+    'DEFAULT_PAGINATION_CLASS': 'sheets.pagination.SheetsCursorPagination',
+    'PAGE_SIZE': 100,
+}
+
+# Per-request query count, database time, serializer time and response size,
+# reported in X-* response headers, `sheets.instrumentation` logs and /instrumentation/stats/
+
+SHEETS_INSTRUMENTATION = False
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'sheets.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
 }
 
 # JWT_AUTH = {
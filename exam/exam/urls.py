@@ -17,7 +17,8 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from sheets.views import ExamSheetViewSet, TaskViewSet, AnswerViewSet, SolutionViewSet
+from sheets.views import ExamSheetViewSet, TaskViewSet, AnswerViewSet, SolutionViewSet, GradingJobViewSet, \
+    InstrumentationStatsView
 
 router = DefaultRouter()
 
@@ -25,10 +26,12 @@ router.register(r'exam_sheets', ExamSheetViewSet)
 router.register(r'tasks', TaskViewSet)
 router.register(r'answers', AnswerViewSet)
 router.register(r'solutions', SolutionViewSet)
+router.register(r'grading_jobs', GradingJobViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path(r'', include(router.urls)),
+    path(r'instrumentation/stats/', InstrumentationStatsView.as_view()),
     path(r'', include('rest_auth.urls')),
     path(r'registration/', include('rest_auth.registration.urls'))
 ]
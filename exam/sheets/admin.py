@@ -8,3 +8,5 @@ admin.site.register(User)
 admin.site.register(ExamSheet)
 admin.site.register(Answer)
 admin.site.register(Solution)
+admin.site.register(ExamSheetGrade)
+admin.site.register(GradingJob)
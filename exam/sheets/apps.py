@@ -3,3 +3,15 @@ from django.apps import AppConfig
 
 class SheetsConfig(AppConfig):
     name = 'sheets'
+
+    def ready(self):
+        from django.conf import settings
+        from django.core.signals import request_started
+        from django.db.backends.signals import connection_created
+
+        from sheets import db, signals  # noqa: F401
+
+        if settings.SHEETS_DB_HEALTH_CHECKS:
+            request_started.connect(db.close_unusable_connections)
+        if settings.SHEETS_SQLITE_PRAGMAS:
+            connection_created.connect(db.configure_sqlite)
@@ -0,0 +1,52 @@
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+def get_cache():
+    return caches[settings.SHEETS_CACHE]
+
+
+def _version_key(pk):
+    return f'sheets:exam_sheet:{pk}:version'
+
+
+def _data_key(pk, version, part):
+    return f'sheets:exam_sheet:{pk}:{version}:{part}'
+
+
+def exam_sheet_versions(pks):
+    """
+    Return `{pk: version}` of rendered exam sheets, starting a new version for sheets without one.
+    """
+    cache = get_cache()
+    keys = {_version_key(pk): pk for pk in pks}
+    versions = {keys[key]: version for key, version in cache.get_many(keys).items()}
+    for key, pk in keys.items():
+        if pk not in versions:
+            cache.add(key, uuid.uuid4().hex, None)
+            versions[pk] = cache.get(key)
+    return versions
+
+
+def bump_exam_sheet_versions(pks):
+    """
+    Make cached renders of given exam sheets unreachable, now and once the current transaction commits.
+    """
+    keys = [_version_key(pk) for pk in set(pks)]
+    if not keys:
+        return
+    get_cache().delete_many(keys)
+    transaction.on_commit(lambda: get_cache().delete_many(keys))
+
+
+def get_exam_sheets(versions, part='data'):
+    keys = {_data_key(pk, version, part): pk for pk, version in versions.items() if version}
+    return {keys[key]: value for key, value in get_cache().get_many(keys).items()}
+
+
+def set_exam_sheets(versions, values_by_pk, part='data'):
+    get_cache().set_many({_data_key(pk, versions[pk], part): value for pk, value in values_by_pk.items()
+                          if versions.get(pk)})
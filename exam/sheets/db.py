@@ -0,0 +1,119 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+_local = threading.local()
+_replica_failures = {}
+
+
+def set_replica_reads(enabled):
+    """
+    Send reads of the current thread to one healthy replica, kept until reads are disabled so that every query
+    of a request sees the same snapshot.
+    """
+    if not enabled:
+        _local.replica = None
+    elif getattr(_local, 'replica', None) is None:
+        replicas = healthy_replicas()
+        _local.replica = random.choice(replicas) if replicas else 'default'
+
+
+def read_alias():
+    return getattr(_local, 'replica', None) or 'default'
+
+
+@contextmanager
+def primary():
+    """
+    Read from the primary database inside the block, e.g. before caching what was read.
+    """
+    replica = getattr(_local, 'replica', None)
+    _local.replica = None
+    try:
+        yield
+    finally:
+        _local.replica = replica
+
+
+def replica_aliases():
+    return [alias for alias in connections if alias != 'default']
+
+
+def healthy_replicas():
+    """
+    Return replicas accepting connections, skipping for `SHEETS_REPLICA_RETRY` seconds those that failed.
+    """
+    healthy = []
+    now = time.monotonic()
+    for alias in replica_aliases():
+        if now - _replica_failures.get(alias, -settings.SHEETS_REPLICA_RETRY) < settings.SHEETS_REPLICA_RETRY:
+            continue
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            _replica_failures[alias] = now
+            continue
+        healthy.append(alias)
+    return healthy
+
+
+class ReadReplicaRouter:
+    """
+    Send reads of read-only viewset actions to the replica chosen for the request and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        return read_alias()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def close_unusable_connections(**kwargs):
+    """
+    Drop persistent connections the server closed since the previous request, before they are used.
+    """
+    for connection in connections.all():
+        if connection.connection is not None and not connection.is_usable():
+            connection.close()
+
+
+SQLITE_PRAGMAS = {
+    # SQLite defaults, every commit syncs a rollback journal and writers lock out readers.
+    'rollback': {
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+    },
+    'wal': {
+        'journal_mode': 'WAL',
+    },
+    # Single node deployments: fewer fsyncs, memory mapped reads, 64 MB page cache and waiting on locks.
+    'tuned': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'busy_timeout': 5000,
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """
+    Apply the `SHEETS_SQLITE_PRAGMAS` profile to every new SQLite connection.
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in SQLITE_PRAGMAS[settings.SHEETS_SQLITE_PRAGMAS].items():
+                cursor.execute(f'PRAGMA {pragma}={value}')
@@ -0,0 +1,70 @@
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from sheets.models import Answer, AnswerQuerySet, ExamSheetGrade
+
+ANSWER_COLUMNS = ('id', 'creator', 'task', 'solution', 'choice_answer', 'text_answer', 'submit', 'grade',
+                  'calculated_grade', 'created', 'edited')
+GRADE_COLUMNS = ('exam_sheet', 'user', 'final_grade', 'edited')
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class Echo:
+    """
+    File-like object that hands written CSV lines back instead of buffering them.
+    """
+
+    def write(self, value):
+        return value
+
+
+def answer_rows(answers, chunk_size=2000):
+    return ANSWER_COLUMNS, answers.order_by('pk').annotate(
+        calculated_grade=AnswerQuerySet.calculated_grade()).values_list(*ANSWER_COLUMNS).iterator(chunk_size)
+
+
+def grade_rows(grades, chunk_size=2000):
+    return GRADE_COLUMNS, grades.order_by('pk').values_list(*GRADE_COLUMNS).iterator(chunk_size)
+
+
+def to_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def to_ndjson(columns, rows):
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+RENDERERS = {
+    'csv': to_csv,
+    'ndjson': to_ndjson,
+}
+
+
+def export_results(results, output, exam_sheet=None, answers=None, grades=None, chunk_size=2000):
+    """
+    Return a lazy iterator of `results` ('answers' or 'grades') lines rendered as `output` ('csv' or 'ndjson').
+    """
+    if results == 'grades':
+        if grades is None:
+            grades = ExamSheetGrade.objects.all()
+        if exam_sheet is not None:
+            grades = grades.filter(exam_sheet=exam_sheet)
+        columns, rows = grade_rows(grades, chunk_size)
+    else:
+        if answers is None:
+            answers = Answer.objects.all()
+        if exam_sheet is not None:
+            answers = answers.filter(task__exam_sheet=exam_sheet)
+        columns, rows = answer_rows(answers, chunk_size)
+    return RENDERERS[output](columns, rows)
@@ -0,0 +1,238 @@
+import functools
+import re
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, F, IntegerField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from sheets.cache import bump_exam_sheet_versions
+from sheets.models import Answer, ExamSheetGrade, GradingJob, Solution, Task
+
+
+def enqueue(answers):
+    """
+    Queue grading of submitted `answers` that have no pending job yet.
+    """
+    answer_ids = {answer.pk for answer in answers if answer.submit}
+    pending = set(GradingJob.objects.filter(answer__in=answer_ids,
+                                            status=GradingJob.PENDING).values_list('answer', flat=True))
+    GradingJob.objects.bulk_create([GradingJob(answer_id=answer_id) for answer_id in answer_ids - pending])
+
+
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+
+def normalize(text):
+    """
+    Compare texts regardless of case, unicode forms, punctuation and whitespace.
+    """
+    return ' '.join(PUNCTUATION.sub(' ', unicodedata.normalize('NFKC', text).casefold()).split())
+
+
+class ExactMatcher:
+    """
+    Matcher of text answers against the `expected` text of a solution.
+    Strategies subclass it and are registered in `SHEETS_GRADING_STRATEGIES`.
+    """
+
+    def __init__(self, expected):
+        self.expected = self.prepare(expected or '')
+
+    def prepare(self, text):
+        return text.strip()
+
+    def matches(self, text):
+        return self.prepare(text or '') == self.expected
+
+
+class NormalizedMatcher(ExactMatcher):
+    def prepare(self, text):
+        return normalize(text)
+
+
+class TokenSetMatcher(ExactMatcher):
+    threshold = 0.8
+
+    def prepare(self, text):
+        return frozenset(normalize(text).split())
+
+    def matches(self, text):
+        tokens = self.prepare(text or '')
+        union = tokens | self.expected
+        return not union or len(tokens & self.expected) / len(union) >= self.threshold
+
+
+class RegexMatcher(ExactMatcher):
+    def __init__(self, expected):
+        super().__init__(expected)
+        self.pattern = re.compile(self.expected, re.IGNORECASE)
+
+    def prepare(self, text):
+        return text
+
+    def matches(self, text):
+        return self.pattern.fullmatch((text or '').strip()) is not None
+
+
+def get_strategies():
+    return {name: import_string(path) for name, path in settings.SHEETS_GRADING_STRATEGIES.items()}
+
+
+@functools.lru_cache(maxsize=1024)
+def get_matcher(strategy, expected):
+    """
+    Return the compiled matcher of a solution, shared by every answer to it.
+    """
+    return get_strategies()[strategy](expected)
+
+
+def get_solution_matcher(solution):
+    return get_matcher(solution.grading or settings.SHEETS_DEFAULT_GRADING, solution.text_answer)
+
+
+def grade_answer(answer):
+    solution = answer.solution
+    if solution is None or not answer.submit:
+        return 0
+    if answer.task.type == Task.TEXT:
+        correct = get_solution_matcher(solution).matches(answer.text_answer)
+    else:
+        correct = answer.choice_answer == solution.choice_answer
+    return (solution.points or 0) if correct else 0
+
+
+def grade_answers(answers):
+    """
+    Set `grade` of `answers` in place, answers need their solution and task loaded.
+    """
+    for answer in answers:
+        answer.grade = grade_answer(answer)
+    return answers
+
+
+def refresh_results(answer_owners):
+    """
+    Refresh cached sheets and stored final grades after grades of answers given as `(task id, creator id)` changed.
+    """
+    answer_owners = set(answer_owners)
+    task_exam_sheets = {}
+    for task_id, exam_sheet_id in Task.exam_sheet.through.objects.filter(
+            task__in={task_id for task_id, _ in answer_owners}).values_list('task', 'examsheet'):
+        task_exam_sheets.setdefault(task_id, set()).add(exam_sheet_id)
+    bump_exam_sheet_versions({exam_sheet_id for exam_sheet_ids in task_exam_sheets.values()
+                              for exam_sheet_id in exam_sheet_ids})
+    ExamSheetGrade.refresh((exam_sheet_id, creator_id)
+                           for task_id, creator_id in answer_owners
+                           for exam_sheet_id in task_exam_sheets.get(task_id, ()))
+
+
+def store_grades(answers):
+    """
+    Save `grade` of already graded `answers` and refresh everything derived from them.
+    """
+    now = timezone.now()
+    for answer in answers:
+        answer.edited = now
+    Answer.objects.bulk_update(answers, ['grade', 'edited'])
+    refresh_results((answer.task_id, answer.creator_id) for answer in answers)
+
+
+def regrade_batch(answer_ids):
+    """
+    Recompute grades of answers with `answer_ids` in one transaction.
+    Choice answers are graded by a single UPDATE, text answers by one UPDATE per distinct grade.
+    """
+    with transaction.atomic():
+        answers = Answer.objects.filter(pk__in=answer_ids)
+        solution = Solution.objects.filter(pk=OuterRef('solution'))
+        now = timezone.now()
+        answers.exclude(task__type=Task.TEXT).update(
+            edited=now,
+            grade=Case(When(submit=True,
+                            choice_answer=Subquery(solution.values('choice_answer')[:1]),
+                            then=Coalesce(Subquery(solution.values('points')[:1]), Value(0))),
+                       default=Value(0),
+                       output_field=IntegerField()))
+        text_grades = {}
+        for answer in answers.filter(task__type=Task.TEXT).select_related('solution', 'task'):
+            text_grades.setdefault(grade_answer(answer), []).append(answer.pk)
+        for grade, pks in text_grades.items():
+            Answer.objects.filter(pk__in=pks).update(grade=grade, edited=now)
+        refresh_results(answers.values_list('task', 'creator'))
+    return len(answer_ids)
+
+
+def _regrade_in_thread(answer_ids):
+    try:
+        return regrade_batch(answer_ids)
+    finally:
+        close_old_connections()
+
+
+def regrade(answers, batch_size=1000, workers=1, progress=None):
+    """
+    Recompute grades of `answers` in batched transactions, spread over `workers` threads when above one.
+    `progress` is called with the number of regraded answers and the total after every batch.
+    """
+    answer_ids = list(answers.order_by('pk').values_list('pk', flat=True))
+    batches = [answer_ids[i:i + batch_size] for i in range(0, len(answer_ids), batch_size)]
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    regraded = 0
+    try:
+        for count in executor.map(_regrade_in_thread, batches) if executor else map(regrade_batch, batches):
+            regraded += count
+            if progress is not None:
+                progress(regraded, len(answer_ids))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return regraded
+
+
+def claim_jobs(limit):
+    """
+    Mark up to `limit` pending jobs as running for this worker and return their ids.
+    """
+    worker = uuid.uuid4().hex
+    job_ids = list(GradingJob.objects.filter(status=GradingJob.PENDING).order_by('pk').values_list('pk',
+                                                                                                  flat=True)[:limit])
+    GradingJob.objects.filter(pk__in=job_ids, status=GradingJob.PENDING).update(status=GradingJob.RUNNING,
+                                                                                 worker=worker,
+                                                                                 started=timezone.now(),
+                                                                                 attempts=F('attempts') + 1)
+    return list(GradingJob.objects.filter(worker=worker, status=GradingJob.RUNNING).values_list('pk', flat=True))
+
+
+def requeue_stale_jobs(older_than):
+    return GradingJob.objects.filter(status=GradingJob.RUNNING,
+                                     started__lt=timezone.now() - timedelta(seconds=older_than)).update(
+        status=GradingJob.PENDING, worker=None)
+
+
+def run_jobs(job_ids):
+    """
+    Grade answers of claimed jobs. Runs in worker threads and processes, so it manages its own connection.
+    """
+    try:
+        jobs = GradingJob.objects.filter(pk__in=job_ids).select_related('answer__solution', 'answer__task')
+        answers = {job.answer_id: job.answer for job in jobs}
+        try:
+            with transaction.atomic():
+                store_grades(grade_answers(list(answers.values())))
+                GradingJob.objects.filter(pk__in=job_ids).update(status=GradingJob.DONE,
+                                                                 error=None,
+                                                                 finished=timezone.now())
+        except Exception as error:
+            GradingJob.objects.filter(pk__in=job_ids).update(status=GradingJob.FAILED,
+                                                             error=repr(error),
+                                                             finished=timezone.now())
+        return len(job_ids)
+    finally:
+        close_old_connections()
@@ -0,0 +1,36 @@
+import csv
+
+from rest_framework.exceptions import ValidationError
+
+from sheets.serializers import TemplateImportSerializer
+
+CSV_COLUMNS = ('question', 'type', 'text_answer', 'choice_answer', 'points')
+
+
+def parse_template_csv(lines, name):
+    """
+    Build an import document from CSV rows, consecutive rows with the same question form one task.
+    """
+    reader = csv.DictReader(lines)
+    missing = set(CSV_COLUMNS) - set(reader.fieldnames or ())
+    if missing:
+        raise ValidationError({'columns': [f'Missing column: {column}' for column in sorted(missing)]})
+
+    tasks = []
+    for row in reader:
+        if not tasks or (tasks[-1]['question'], tasks[-1]['type']) != (row['question'], row['type']):
+            tasks.append({'question': row['question'],
+                          'type': row['type'],
+                          'solutions': []})
+        solution = {key: row[key] for key in ('text_answer', 'choice_answer', 'points') if row[key] != ''}
+        if solution and row.get('grading'):
+            solution['grading'] = row['grading']
+        if solution:
+            tasks[-1]['solutions'].append(solution)
+    return {'name': name, 'tasks': tasks}
+
+
+def import_template(document, creator):
+    serializer = TemplateImportSerializer(data=document)
+    serializer.is_valid(raise_exception=True)
+    return serializer.save(creator=creator)
@@ -0,0 +1,157 @@
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger('sheets.instrumentation')
+
+_local = threading.local()
+
+
+class RequestStats:
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializing = False
+        self.view = None
+        self.action = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.query_count += 1
+
+    @property
+    def key(self):
+        return f'{self.view}.{self.action}' if self.view else 'other'
+
+
+def current_stats():
+    return getattr(_local, 'stats', None)
+
+
+class StatsRegistry:
+    """
+    In-process aggregate of request stats grouped by viewset and action.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, stats, duration, response_size):
+        with self._lock:
+            entry = self._stats.setdefault(stats.key, {
+                'requests': 0,
+                'queries': 0,
+                'max_queries': 0,
+                'db_time': 0.0,
+                'serializer_time': 0.0,
+                'duration': 0.0,
+                'response_size': 0,
+            })
+            entry['requests'] += 1
+            entry['queries'] += stats.query_count
+            entry['max_queries'] = max(entry['max_queries'], stats.query_count)
+            entry['db_time'] += stats.db_time
+            entry['serializer_time'] += stats.serializer_time
+            entry['duration'] += duration
+            entry['response_size'] += response_size or 0
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(entry,
+                              avg_queries=entry['queries'] / entry['requests'],
+                              avg_duration=entry['duration'] / entry['requests'])
+                    for key, entry in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+registry = StatsRegistry()
+
+
+class TimedRepresentationMixin:
+    """
+    Add the time spent in the outermost `to_representation` call to the current request stats.
+    """
+
+    def to_representation(self, instance):
+        stats = current_stats()
+        if stats is None or stats.serializing:
+            return super().to_representation(instance)
+        stats.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - start
+            stats.serializing = False
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Measure queries, database time, serializer time and response size of every request.
+
+    Enabled with `SHEETS_INSTRUMENTATION = True`.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SHEETS_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = _local.stats = RequestStats()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+        finally:
+            _local.stats = None
+        duration = time.perf_counter() - start
+        response_size = None if response.streaming else len(response.content)
+
+        response['X-Query-Count'] = stats.query_count
+        response['X-DB-Time'] = f'{stats.db_time * 1000:.2f}'
+        response['X-Serializer-Time'] = f'{stats.serializer_time * 1000:.2f}'
+        if response_size is not None:
+            response['X-Response-Size'] = response_size
+        if stats.view:
+            response['X-View'] = stats.key
+
+        registry.record(stats, duration, response_size)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'view': stats.view,
+            'action': stats.action,
+            'queries': stats.query_count,
+            'db_time_ms': round(stats.db_time * 1000, 2),
+            'serializer_time_ms': round(stats.serializer_time * 1000, 2),
+            'duration_ms': round(duration * 1000, 2),
+            'response_size': response_size,
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        stats = current_stats()
+        view_class = getattr(view_func, 'cls', None)
+        if stats is not None and view_class is not None:
+            stats.view = view_class.__name__
+            stats.action = (getattr(view_func, 'actions', None) or {}).get(request.method.lower(),
+                                                                             request.method.lower())
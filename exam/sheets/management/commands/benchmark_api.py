@@ -0,0 +1,118 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIClient
+
+from sheets.models import Answer, ExamSheet, Solution, Task
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(percent / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = ('Drive every sheets endpoint through the test client and report latency percentiles and query counts. '
+            'All writes are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--only', help='Run only operations whose name contains this text')
+
+    def handle(self, *args, **options):
+        if not ExamSheet.objects.filter(template=True).exists() or not Answer.objects.exists():
+            raise CommandError('Database is empty, run seed_data first')
+
+        results = []
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            self.setup(options['repeat'])
+            for name, method, url, payload_factory in self.operations():
+                if options['only'] and options['only'] not in name:
+                    continue
+                results.append(self.measure(name, method, url, payload_factory,
+                                            options['repeat'], options['page_size']))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{"operation":<32}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"max ms":>10}{"queries":>10}')
+        for name, timings, queries in results:
+            self.stdout.write(f'{name:<32}'
+                              f'{percentile(timings, 50):>10.2f}{percentile(timings, 95):>10.2f}'
+                              f'{percentile(timings, 99):>10.2f}{max(timings):>10.2f}{max(queries):>10}')
+
+    def setup(self, repeat):
+        tag = uuid.uuid4().hex[:8]
+        # Act as a student who already answered, lists are scoped to what the caller may see.
+        self.answer = Answer.objects.filter(creator__is_superuser=False).order_by('pk').first() or \
+            Answer.objects.order_by('pk').first()
+        self.user = self.answer.creator
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        self.template = ExamSheet.objects.filter(template=True).order_by('pk').first()
+        self.task = Task.objects.filter(exam_sheet=self.template).order_by('pk').first()
+        self.solution = Solution.objects.filter(task=self.task).order_by('pk').first()
+
+        self.own_template = ExamSheet.objects.create(name=f'benchmark-{tag}', creator=self.user)
+        self.own_task = Task.objects.create(type=Task.MULTI_CHOICE, question='benchmark', creator=self.user)
+        self.own_task.exam_sheet.add(self.own_template)
+        Solution.objects.bulk_create([Solution(task=self.own_task, creator=self.user, points=1)
+                                      for _ in range(repeat * 3)])
+        self.free_solutions = list(Solution.objects.filter(task=self.own_task).values_list('pk', flat=True))
+
+    def next_solution(self):
+        return self.free_solutions.pop()
+
+    def operations(self):
+        return (
+            ('GET /exam_sheets/', 'get', '/exam_sheets/', None),
+            ('GET /exam_sheets/{id}/', 'get', f'/exam_sheets/{self.template.pk}/', None),
+            ('GET /exam_sheets/exams/', 'get', '/exam_sheets/exams/', None),
+            ('GET /exam_sheets/templates/', 'get', '/exam_sheets/templates/', None),
+            ('POST /exam_sheets/', 'post', '/exam_sheets/', lambda: {'name': 'benchmark', 'template': True}),
+            ('PATCH /exam_sheets/{id}/', 'patch', f'/exam_sheets/{self.own_template.pk}/',
+             lambda: {'name': 'benchmark'}),
+            ('GET /tasks/', 'get', '/tasks/', None),
+            ('GET /tasks/{id}/', 'get', f'/tasks/{self.task.pk}/', None),
+            ('POST /tasks/', 'post', '/tasks/', lambda: {'type': Task.MULTI_CHOICE,
+                                                         'exam_sheet': [self.own_template.pk],
+                                                         'question': 'benchmark'}),
+            ('GET /solutions/', 'get', '/solutions/', None),
+            ('GET /solutions/{id}/', 'get', f'/solutions/{self.solution.pk}/', None),
+            ('POST /solutions/', 'post', '/solutions/', lambda: {'task': self.own_task.pk,
+                                                                 'text_answer': 'benchmark',
+                                                                 'points': 1}),
+            ('GET /answers/', 'get', '/answers/', None),
+            ('GET /answers/{id}/', 'get', f'/answers/{self.answer.pk}/', None),
+            ('POST /answers/', 'post', '/answers/', lambda: {'task': self.own_task.pk,
+                                                             'solution': self.next_solution(),
+                                                             'submit': True}),
+            ('POST /answers/bulk/', 'post', '/answers/bulk/', lambda: {'answers': [
+                {'task': self.own_task.pk, 'solution': self.next_solution(), 'submit': True}
+                for _ in range(2)]}),
+        )
+
+    def measure(self, name, method, url, payload_factory, repeat, page_size):
+        timings = []
+        queries = []
+        for _ in range(repeat):
+            kwargs = {'format': 'json'}
+            if payload_factory is not None:
+                kwargs['data'] = payload_factory()
+            elif method == 'get':
+                kwargs = {'data': {'page_size': page_size}}
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                response = getattr(self.client, method)(url, **kwargs)
+                if hasattr(response, 'render'):
+                    response.render()
+                timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise CommandError(f'{name} returned {response.status_code}: {response.content[:200]}')
+            queries.append(len(context.captured_queries))
+        return name, timings, queries
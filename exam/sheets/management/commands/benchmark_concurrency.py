@@ -0,0 +1,79 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+from rest_framework.test import APIClient
+
+from sheets.db import SQLITE_PRAGMAS
+from sheets.management.commands.benchmark_api import percentile
+from sheets.models import ExamSheet, Solution, Task, User
+
+
+class Command(BaseCommand):
+    help = ('Submit answers from parallel clients with each SQLite pragmas profile and report write throughput. '
+            'Created users, exams and answers are deleted afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Clients submitting in parallel')
+        parser.add_argument('--requests', type=int, default=50, help='Answers submitted by every client')
+        parser.add_argument('--profiles', nargs='+', choices=sorted(SQLITE_PRAGMAS), default=['rollback', 'tuned'])
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Pragmas profiles only apply to SQLite databases')
+
+        self.stdout.write(f'{"profile":<12}{"answers/s":>12}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}{"errors":>10}')
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for profile in options['profiles']:
+                with override_settings(SHEETS_SQLITE_PRAGMAS=profile):
+                    # Reconnect so that every connection starts with the profile's pragmas.
+                    connections.close_all()
+                    throughput, timings, errors = self.measure(options['workers'], options['requests'])
+                self.stdout.write(f'{profile:<12}{throughput:>12.1f}{percentile(timings, 50):>10.2f}'
+                                  f'{percentile(timings, 95):>10.2f}{max(timings):>10.2f}{errors:>10}')
+        connections.close_all()
+
+    def measure(self, workers, requests):
+        tag = uuid.uuid4().hex[:8]
+        author = User.objects.create_user(f'concurrency-{tag}', f'{tag}@benchmark.com', 'TajneHaslo')
+        students = [User.objects.create_user(f'concurrency-{tag}-{number}', f'{tag}-{number}@benchmark.com',
+                                             'TajneHaslo')
+                    for number in range(workers)]
+        template = ExamSheet.objects.create(name=f'concurrency-{tag}', template=True, creator=author)
+        task = Task.objects.create(type=Task.MULTI_CHOICE, question='concurrency', creator=author)
+        task.exam_sheet.add(template)
+        Solution.objects.bulk_create([Solution(task=task, creator=author, points=1) for _ in range(requests)])
+        solutions = list(Solution.objects.filter(task=task).values_list('pk', flat=True))
+
+        def submit(student):
+            client = APIClient()
+            client.force_authenticate(student)
+            timings = []
+            errors = 0
+            try:
+                for solution in solutions:
+                    start = time.perf_counter()
+                    try:
+                        response = client.post('/answers/', {'task': task.pk, 'solution': solution, 'submit': True},
+                                               format='json')
+                        errors += response.status_code != 201
+                    except Exception:
+                        errors += 1
+                    timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+            return timings, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(submit, students))
+        elapsed = time.perf_counter() - start
+
+        User.objects.filter(pk__in=[author.pk] + [student.pk for student in students]).delete()
+        timings = [timing for worker_timings, _ in results for timing in worker_timings]
+        errors = sum(worker_errors for _, worker_errors in results)
+        return (len(timings) - errors) / elapsed, timings, errors
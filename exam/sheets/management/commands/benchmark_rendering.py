@@ -0,0 +1,60 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from sheets.management.commands.benchmark_api import percentile
+from sheets.models import ExamSheet
+from sheets.parsers import FastJSONParser
+from sheets.renderers import FastJSONRenderer, orjson
+from sheets.serializers import ExamSheetSerializer
+from sheets.views import ExamSheetViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare serializing, rendering and parsing template exam sheets with the default and fast paths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--limit', type=int, default=100, help='Number of template exam sheets rendered')
+
+    def handle(self, *args, **options):
+        exam_sheets = list(ExamSheet.objects.filter(template=True).order_by('-id')
+                           .prefetch_related(*ExamSheetViewSet.prefetch_related)[:options['limit']])
+        if not exam_sheets:
+            raise CommandError('Database is empty, run seed_data first')
+
+        with override_settings(SHEETS_FAST_REPRESENTATION=False):
+            data = ExamSheetSerializer(exam_sheets, many=True, context={}).data
+        if ExamSheetSerializer(exam_sheets, many=True, context={}).data != data:
+            raise CommandError('Fast serializer path renders different data')
+        content = JSONRenderer().render(data)
+
+        def serialize():
+            return ExamSheetSerializer(exam_sheets, many=True, context={}).data
+
+        def serialize_default():
+            with override_settings(SHEETS_FAST_REPRESENTATION=False):
+                return serialize()
+
+        operations = (
+            ('serialize (DRF fields)', serialize_default),
+            ('serialize (fast path)', serialize),
+            ('render (json)', lambda: JSONRenderer().render(data)),
+            (f'render ({"orjson" if orjson else "json fallback"})', lambda: FastJSONRenderer().render(data)),
+            ('parse (json)', lambda: JSONParser().parse(io.BytesIO(content))),
+            (f'parse ({"orjson" if orjson else "json fallback"})', lambda: FastJSONParser().parse(io.BytesIO(content))),
+        )
+        self.stdout.write(f'{len(exam_sheets)} exam sheets, {len(content)} bytes')
+        self.stdout.write(f'{"operation":<32}{"p50 ms":>10}{"p95 ms":>10}{"max ms":>10}')
+        for name, operation in operations:
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                operation()
+                timings.append((time.perf_counter() - start) * 1000)
+            self.stdout.write(f'{name:<32}{percentile(timings, 50):>10.2f}{percentile(timings, 95):>10.2f}'
+                              f'{max(timings):>10.2f}')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sheets.cache import bump_exam_sheet_versions
+from sheets.models import ExamSheet
+
+
+class Command(BaseCommand):
+    help = 'Compare stored exam sheet task counts and max scores with totals calculated from tasks and solutions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Refresh every inconsistent exam sheet')
+
+    def handle(self, *args, **options):
+        stale = ExamSheet.objects.with_stale_totals().values_list('pk', 'task_count', 'calculated_task_count',
+                                                                  'max_score', 'calculated_max_score')
+        inconsistent = set()
+        for pk, task_count, calculated_task_count, max_score, calculated_max_score in stale:
+            inconsistent.add(pk)
+            self.stdout.write(f'exam sheet {pk}: stored {task_count} tasks and {max_score} points, '
+                              f'calculated {calculated_task_count} tasks and {calculated_max_score} points')
+
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS(f'All {ExamSheet.objects.count()} exam sheet totals are consistent'))
+        elif options['fix']:
+            ExamSheet.objects.filter(pk__in=inconsistent).refresh_totals()
+            bump_exam_sheet_versions(inconsistent)
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(inconsistent)} exam sheet totals'))
+        else:
+            raise CommandError(f'{len(inconsistent)} exam sheet totals are inconsistent')
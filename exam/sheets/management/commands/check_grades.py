@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from sheets.models import Answer, ExamSheetGrade
+
+
+class Command(BaseCommand):
+    help = 'Compare stored exam sheet final grades with grades calculated from answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Refresh every inconsistent final grade')
+
+    def handle(self, *args, **options):
+        calculated = {(row['task__exam_sheet'], row['creator']): row['final_grade']
+                      for row in Answer.objects.for_graded_exam_sheets().final_grades()}
+        stored = {(row['exam_sheet'], row['user']): row['final_grade']
+                  for row in ExamSheetGrade.objects.values('exam_sheet', 'user', 'final_grade')}
+
+        inconsistent = set()
+        for key in calculated.keys() | stored.keys():
+            if calculated.get(key, 0) != stored.get(key):
+                inconsistent.add(key)
+                self.stdout.write(f'exam sheet {key[0]}, user {key[1]}: '
+                                  f'stored {stored.get(key)}, calculated {calculated.get(key, 0)}')
+
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS(f'All {len(stored)} final grades are consistent'))
+        elif options['fix']:
+            ExamSheetGrade.refresh(inconsistent)
+            self.stdout.write(self.style.SUCCESS(f'Fixed {len(inconsistent)} final grades'))
+        else:
+            raise CommandError(f'{len(inconsistent)} final grades are inconsistent')
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from sheets.models import Answer, ExamSheet, Solution
+
+
+class Command(BaseCommand):
+    help = ('Print database query plans of the hot sheets queries. '
+            'Run it before and after `migrate sheets` to compare plans.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, default=1)
+        parser.add_argument('--task', type=int, default=1)
+        parser.add_argument('--solution', type=int, default=1)
+        parser.add_argument('--template', type=int, default=1)
+
+    def handle(self, *args, **options):
+        user, task = options['user'], options['task']
+        queries = {
+            'user exams': ExamSheet.objects.filter(creator=user, template=False),
+            'user exam of template': ExamSheet.objects.filter(creator=user, origin=options['template'],
+                                                              template=False),
+            'user answer of solution': Answer.objects.filter(creator=user, solution=options['solution']),
+            'user answers of task': Answer.objects.filter(creator=user, task=task),
+            'solutions of task': Solution.objects.filter(task=task),
+        }
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain())
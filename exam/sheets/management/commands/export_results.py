@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from sheets.exports import RENDERERS, export_results
+
+
+class Command(BaseCommand):
+    help = 'Stream answers or final grades as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--type', dest='results', choices=('answers', 'grades'), default='answers')
+        parser.add_argument('--output', choices=sorted(RENDERERS), default='ndjson')
+        parser.add_argument('--exam-sheet', type=int)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--file', help='Write to this path instead of stdout')
+
+    def handle(self, *args, **options):
+        lines = export_results(options['results'], options['output'],
+                               exam_sheet=options['exam_sheet'],
+                               chunk_size=options['chunk_size'])
+        if options['file']:
+            with open(options['file'], 'w', newline='', encoding='utf-8') as export_file:
+                export_file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,43 @@
+import io
+import json
+import os
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ValidationError
+
+from sheets.importers import import_template, parse_template_csv
+
+
+class Command(BaseCommand):
+    help = 'Import an exam template with its tasks and solutions from a JSON or CSV document'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--creator', required=True,
+                            help='Username of the template author')
+        parser.add_argument('--name',
+                            help='Template name, required for CSV documents')
+
+    def handle(self, *args, **options):
+        try:
+            creator = get_user_model().objects.get(username=options['creator'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'User {options["creator"]} does not exist')
+
+        with io.open(options['path'], newline='', encoding='utf-8') as document_file:
+            if os.path.splitext(options['path'])[1].lower() == '.csv':
+                if not options['name']:
+                    raise CommandError('--name is required for CSV documents')
+                document = parse_template_csv(document_file, options['name'])
+            else:
+                document = json.load(document_file)
+                if options['name']:
+                    document['name'] = options['name']
+
+        try:
+            exam_sheet = import_template(document, creator)
+        except ValidationError as error:
+            raise CommandError(json.dumps(error.detail, indent=2))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported template {exam_sheet.pk} with {exam_sheet.tasks.count()} tasks'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sheets.models import Answer, ExamSheetGrade
+
+
+class Command(BaseCommand):
+    help = 'Rebuild stored exam sheet final grades from answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            help='Rows per INSERT, defaults to the database limit')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        ExamSheetGrade.objects.all().delete()
+        grades = [ExamSheetGrade(exam_sheet_id=row['task__exam_sheet'],
+                                 user_id=row['creator'],
+                                 final_grade=row['final_grade'])
+                  for row in Answer.objects.for_graded_exam_sheets().final_grades()]
+        ExamSheetGrade.objects.bulk_create(grades, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(grades)} final grades'))
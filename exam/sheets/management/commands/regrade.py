@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from sheets import grading
+from sheets.models import Answer
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored grades of answers, e.g. after solutions were edited'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--exam-sheet', type=int, help='Only answers to tasks of this exam sheet')
+        parser.add_argument('--task', type=int, help='Only answers to this task')
+        parser.add_argument('--solution', type=int, help='Only answers to this solution')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Answers regraded in one transaction')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of threads regrading batches in parallel')
+
+    def handle(self, *args, **options):
+        answers = Answer.objects.all()
+        if options['exam_sheet'] is not None:
+            answers = answers.filter(task__exam_sheet=options['exam_sheet'])
+        if options['task'] is not None:
+            answers = answers.filter(task=options['task'])
+        if options['solution'] is not None:
+            answers = answers.filter(solution=options['solution'])
+
+        def progress(regraded, total):
+            self.stdout.write(f'Regraded {regraded}/{total} answers')
+
+        regraded = grading.regrade(answers,
+                                   batch_size=options['batch_size'],
+                                   workers=options['workers'],
+                                   progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Regraded {regraded} answers'))
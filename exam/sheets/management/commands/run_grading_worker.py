@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from sheets import grading
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+class Command(BaseCommand):
+    help = 'Grade submitted answers queued as grading jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Number of threads or processes grading in parallel')
+        parser.add_argument('--mode', choices=sorted(EXECUTORS), default='thread',
+                            help='Grade jobs in a thread pool or a process pool')
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Jobs graded together by a single worker')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--requeue-after', type=int, default=600,
+                            help='Seconds after which running jobs of a dead worker are queued again')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        batch_size = options['batch_size']
+        graded = 0
+        # Forked processes must not share the parent's database connections.
+        connections.close_all()
+        with EXECUTORS[options['mode']](max_workers=workers) as executor:
+            while True:
+                requeued = grading.requeue_stale_jobs(options['requeue_after'])
+                if requeued:
+                    self.stdout.write(f'Requeued {requeued} stale jobs')
+                job_ids = grading.claim_jobs(workers * batch_size)
+                connections.close_all()
+                if not job_ids:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                batches = [job_ids[i:i + batch_size] for i in range(0, len(job_ids), batch_size)]
+                graded += sum(executor.map(grading.run_jobs, batches))
+                self.stdout.write(f'Graded {graded} answers')
+        self.stdout.write(self.style.SUCCESS(f'Graded {graded} answers'))
@@ -0,0 +1,99 @@
+import random
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from sheets.models import Answer, ExamSheet, Solution, Task, User
+
+
+class Command(BaseCommand):
+    help = 'Seed users, exam templates, tasks, solutions and answered exams with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--templates', type=int, default=10)
+        parser.add_argument('--tasks', type=int, default=20,
+                            help='Tasks per template')
+        parser.add_argument('--solutions', type=int, default=4,
+                            help='Solutions per task')
+        parser.add_argument('--exams', type=int, default=1,
+                            help='Templates answered by every user')
+        parser.add_argument('--password', default='TajneHaslo')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int,
+                            help='Rows per INSERT, defaults to the database limit')
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        tag = f'seed-{uuid.uuid4().hex[:8]}'
+
+        password = make_password(options['password'])
+        User.objects.bulk_create([User(username=f'{tag}-user-{number}', password=password)
+                                  for number in range(options['users'])], batch_size=batch_size)
+        users = list(User.objects.filter(username__startswith=tag).order_by('pk'))
+        authors = users[:max(1, len(users) // 10)]
+
+        ExamSheet.objects.bulk_create([ExamSheet(name=f'{tag}-template-{number}',
+                                                 creator=rng.choice(authors),
+                                                 template=True)
+                                       for number in range(options['templates'])], batch_size=batch_size)
+        templates = list(ExamSheet.objects.filter(name__startswith=tag, template=True).order_by('pk'))
+
+        Task.objects.bulk_create([Task(question=f'{tag}-{template.pk}-{number}',
+                                       type=Task.MULTI_CHOICE,
+                                       creator=template.creator)
+                                  for template in templates
+                                  for number in range(options['tasks'])], batch_size=batch_size)
+        tasks = list(Task.objects.filter(question__startswith=tag).order_by('pk'))
+        template_tasks = {template.pk: [task for task in tasks if task.question.startswith(f'{tag}-{template.pk}-')]
+                          for template in templates}
+        Task.exam_sheet.through.objects.bulk_create(
+            [Task.exam_sheet.through(examsheet_id=template_id, task_id=task.pk)
+             for template_id, template_task_list in template_tasks.items()
+             for task in template_task_list], batch_size=batch_size)
+
+        Solution.objects.bulk_create([Solution(task=task,
+                                               creator=task.creator,
+                                               text_answer=f'solution {number}',
+                                               choice_answer=rng.random() < 0.5,
+                                               points=rng.randint(1, 5))
+                                      for task in tasks
+                                      for number in range(options['solutions'])], batch_size=batch_size)
+        solutions = {}
+        for solution in Solution.objects.filter(task__in=tasks):
+            solutions.setdefault(solution.task_id, []).append(solution)
+
+        taken = {user.pk: rng.sample(templates, min(options['exams'], len(templates))) for user in users}
+        ExamSheet.objects.bulk_create([ExamSheet(name=template.name,
+                                                 creator=user,
+                                                 origin=template,
+                                                 template=False)
+                                       for user in users
+                                       for template in taken[user.pk]], batch_size=batch_size)
+        exams = ExamSheet.objects.filter(name__startswith=tag, template=False)
+        Task.exam_sheet.through.objects.bulk_create(
+            [Task.exam_sheet.through(examsheet_id=exam.pk, task_id=task.pk)
+             for exam in exams
+             for task in template_tasks[exam.origin_id]], batch_size=batch_size)
+
+        Answer.objects.bulk_create([Answer(task_id=solution.task_id,
+                                           solution=solution,
+                                           creator=user,
+                                           choice_answer=rng.random() < 0.5,
+                                           submit=True)
+                                    for user in users
+                                    for template in taken[user.pk]
+                                    for task in template_tasks[template.pk]
+                                    for solution in solutions.get(task.pk, [])], batch_size=batch_size)
+        ExamSheet.objects.filter(name__startswith=tag).refresh_totals()
+        call_command('rebuild_grades', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {tag}: {len(users)} users, {len(templates)} templates, {len(tasks)} tasks, '
+            f'{sum(len(task_solutions) for task_solutions in solutions.values())} solutions, '
+            f'{Answer.objects.filter(creator__in=users).count()} answers'))
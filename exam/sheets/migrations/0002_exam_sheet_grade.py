@@ -0,0 +1,28 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:11
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sheets', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExamSheetGrade',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('final_grade', models.IntegerField(default=0)),
+                ('edited', models.DateTimeField(auto_now=True)),
+                ('exam_sheet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grades', to='sheets.ExamSheet')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exam_sheet_grades', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('exam_sheet', 'user')},
+            },
+        ),
+    ]
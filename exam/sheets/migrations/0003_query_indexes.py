@@ -0,0 +1,42 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_exam_origins(apps, schema_editor):
+    ExamSheet = apps.get_model('sheets', 'ExamSheet')
+    assigned = set()
+    for exam in ExamSheet.objects.filter(template=False, origin__isnull=True).order_by('pk'):
+        origin = ExamSheet.objects.filter(template=True, tasks__exam_sheet=exam).order_by('pk').first()
+        if origin is not None and (exam.creator_id, origin.pk) not in assigned:
+            assigned.add((exam.creator_id, origin.pk))
+            ExamSheet.objects.filter(pk=exam.pk).update(origin=origin)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sheets', '0002_exam_sheet_grade'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examsheet',
+            name='origin',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='instances', to='sheets.ExamSheet'),
+        ),
+        migrations.RunPython(set_exam_origins, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='answer',
+            index=models.Index(fields=['creator', 'task'], name='sheets_answer_creator_task_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='examsheet',
+            index=models.Index(fields=['creator', 'template'], name='sheets_exam_creator_tmpl_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='examsheet',
+            constraint=models.UniqueConstraint(condition=models.Q(template=False), fields=('creator', 'origin'), name='sheets_unique_exam_per_template'),
+        ),
+    ]
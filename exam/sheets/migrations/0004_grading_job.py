@@ -0,0 +1,32 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sheets', '0003_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=16)),
+                ('worker', models.CharField(default=None, max_length=64, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(default=None, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(default=None, null=True)),
+                ('finished', models.DateTimeField(default=None, null=True)),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grading_jobs', to='sheets.Answer')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='gradingjob',
+            index=models.Index(fields=['status', 'id'], name='sheets_grading_job_status_idx'),
+        ),
+    ]
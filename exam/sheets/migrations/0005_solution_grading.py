@@ -0,0 +1,18 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sheets', '0004_grading_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solution',
+            name='grading',
+            field=models.CharField(default=None, max_length=32, null=True),
+        ),
+    ]
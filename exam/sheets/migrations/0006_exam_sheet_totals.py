@@ -0,0 +1,39 @@
+# Generated by Django 2.2.1 on 2026-10-18 20:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def set_exam_sheet_totals(apps, schema_editor):
+    ExamSheet = apps.get_model('sheets', 'ExamSheet')
+    Solution = apps.get_model('sheets', 'Solution')
+    TaskExamSheets = apps.get_model('sheets', 'Task').exam_sheet.through
+    tasks = TaskExamSheets.objects.filter(examsheet=OuterRef('pk')).order_by().values('examsheet')
+    solutions = Solution.objects.filter(task__exam_sheet=OuterRef('pk')).order_by().values('task__exam_sheet')
+    ExamSheet.objects.update(
+        task_count=Coalesce(Subquery(tasks.annotate(count=Count('pk')).values('count'),
+                                     output_field=models.IntegerField()), 0),
+        max_score=Coalesce(Subquery(solutions.annotate(points=Sum('points')).values('points'),
+                                    output_field=models.IntegerField()), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sheets', '0005_solution_grading'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='examsheet',
+            name='max_score',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='examsheet',
+            name='task_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(set_exam_sheet_totals, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import connection, models
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 from sheets.fields import RelatedNameField
 
@@ -24,13 +27,131 @@ class BaseModel(models.Model):
         abstract = True
 
 
+class ExamSheetQuerySet(models.QuerySet):
+
+    @staticmethod
+    def calculated_totals():
+        """
+        Return expressions of the number of tasks of an exam sheet and of its max score, the points of all solutions.
+        """
+        tasks = Task.exam_sheet.through.objects.filter(examsheet=OuterRef('pk')).order_by().values('examsheet')
+        solutions = Solution.objects.filter(task__exam_sheet=OuterRef('pk')).order_by().values('task__exam_sheet')
+        return {
+            'task_count': Coalesce(Subquery(tasks.annotate(count=Count('pk')).values('count'),
+                                            output_field=models.IntegerField()), 0),
+            'max_score': Coalesce(Subquery(solutions.annotate(points=Sum('points')).values('points'),
+                                           output_field=models.IntegerField()), 0),
+        }
+
+    def with_stale_totals(self):
+        totals = self.calculated_totals()
+        return self.annotate(calculated_task_count=totals['task_count'],
+                             calculated_max_score=totals['max_score']).exclude(
+            task_count=F('calculated_task_count'), max_score=F('calculated_max_score'))
+
+    def counting_answers_of(self, user, task_ids):
+        """
+        Keep sheets with `task_ids` on which answers of `user` count: templates and exam instances of `user`.
+        """
+        return self.filter(Q(template=True) | Q(creator=user), tasks__in=task_ids).distinct()
+
+    def refresh_totals(self):
+        """
+        Recalculate stored `task_count` and `max_score` of exam sheets whose totals changed, returns their number.
+        """
+        return self.filter(pk__in=self.with_stale_totals().values('pk')).update(edited=timezone.now(),
+                                                                                **self.calculated_totals())
+
+
 class ExamSheet(BaseModel):
+    objects = ExamSheetQuerySet.as_manager()
+
     template = models.BooleanField(default=True)
     name = models.CharField(max_length=256)
+    origin = models.ForeignKey('self',
+                               related_name='instances',
+                               on_delete=models.SET_NULL,
+                               null=True,
+                               blank=True)
+    task_count = models.IntegerField(default=0)
+    max_score = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['creator', 'template'], name='sheets_exam_creator_tmpl_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['creator', 'origin'],
+                                    condition=models.Q(template=False),
+                                    name='sheets_unique_exam_per_template'),
+        ]
+
+    def get_or_create_instance(self, user):
+        """
+        Return `(exam, created)` with the exam instance of this template taken by `user`.
+
+        A new instance gets every task of the template in one INSERT ... SELECT and the template's totals,
+        so starting an exam takes the same queries for any template size.
+        Safe under concurrent calls, the unique constraint on (creator, origin) turns a lost race into a lookup.
+        """
+        exam, created = ExamSheet.objects.get_or_create(origin=self,
+                                                        creator=user,
+                                                        template=False,
+                                                        defaults={'name': self.name,
+                                                                  'task_count': self.task_count,
+                                                                  'max_score': self.max_score})
+        if created:
+            self._copy_tasks_to(exam)
+            ExamSheetGrade.refresh([(exam.pk, user.pk)])
+        return exam, created
+
+    def _copy_tasks_to(self, exam):
+        through = Task.exam_sheet.through
+        quote_name = connection.ops.quote_name
+        table = quote_name(through._meta.db_table)
+        exam_sheet_column = quote_name(through._meta.get_field('examsheet').column)
+        task_column = quote_name(through._meta.get_field('task').column)
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {table} ({exam_sheet_column}, {task_column}) '
+                           f'SELECT %s, {task_column} FROM {table} WHERE {exam_sheet_column} = %s',
+                           [exam.pk, self.pk])
+
+    def get_answers(self):
+        """
+        Return answers to tasks of this sheet, from everyone on a template and from its taker on an exam instance,
+        whose tasks are shared with the template and other instances.
+        """
+        answers = Answer.objects.filter(task__exam_sheet=self)
+        if not self.template:
+            answers = answers.filter(creator=self.creator_id)
+        return answers
 
     def get_user_final_grade(self, user):
-        answers = Answer.objects.filter(task__exam_sheet=self, creator=user)
-        return sum([answer.calculated_grade for answer in answers])
+        final_grade = ExamSheetGrade.objects.filter(exam_sheet=self, user=user).values_list('final_grade',
+                                                                                            flat=True).first()
+        if final_grade is None:
+            return self.calculate_user_final_grade(user)
+        return final_grade
+
+    def calculate_user_final_grade(self, user):
+        return Answer.objects.filter(task__exam_sheet=self, creator=user).final_grade()
+
+    @staticmethod
+    def get_final_grades(pairs):
+        """
+        Return `{(exam_sheet_id, user_id): final_grade}` for every requested pair in one query.
+        """
+        pairs = {(int(exam_sheet_id), int(user_id)) for exam_sheet_id, user_id in pairs}
+        if not pairs:
+            return {}
+        final_grades = dict.fromkeys(pairs, 0)
+        answers = Answer.objects.filter(task__exam_sheet__in={exam_sheet_id for exam_sheet_id, _ in pairs},
+                                        creator__in={user_id for _, user_id in pairs})
+        for row in answers.final_grades():
+            key = (row['task__exam_sheet'], row['creator'])
+            if key in final_grades:
+                final_grades[key] = row['final_grade']
+        return final_grades
 
 
 class Task(BaseModel):
@@ -74,14 +195,51 @@ class BaseAnswer(BaseModel):
 class Solution(BaseAnswer):
     points = models.IntegerField(null=True,
                                  default=1)
+    grading = models.CharField(max_length=32,
+                               null=True,
+                               default=None)
 
     def __str__(self):
         return f'{self.text_answer}-{self.choice_answer}'
 
 
+class AnswerQuerySet(models.QuerySet):
+
+    @staticmethod
+    def calculated_grade():
+        return Case(When(grade__isnull=False,
+                         then=F('grade')),
+                    # Text answers are only worth points once a grading job matched them.
+                    When(task__type=Task.TEXT,
+                         then=Value(0)),
+                    When(submit=True,
+                         choice_answer=F('solution__choice_answer'),
+                         then=F('solution__points')),
+                    default=Value(0),
+                    output_field=models.IntegerField())
+
+    def for_graded_exam_sheets(self):
+        """
+        Keep answers on template sheets and on exam instances of the answer creator.
+        """
+        return self.filter(Q(task__exam_sheet__template=True) | Q(task__exam_sheet__creator=F('creator')))
+
+    def final_grade(self):
+        return self.aggregate(final_grade=Coalesce(Sum(self.calculated_grade()), 0))['final_grade']
+
+    def final_grades(self):
+        return self.order_by().values('task__exam_sheet', 'creator').annotate(
+            final_grade=Coalesce(Sum(self.calculated_grade()), 0))
+
+
 class Answer(BaseAnswer):
+    objects = AnswerQuerySet.as_manager()
+
     class Meta:
         unique_together = (('creator', 'solution'),)
+        indexes = [
+            models.Index(fields=['creator', 'task'], name='sheets_answer_creator_task_idx'),
+        ]
 
     submit = models.BooleanField(default=False)
     grade = models.IntegerField(null=True,
@@ -94,7 +252,99 @@ class Answer(BaseAnswer):
 
     @property
     def calculated_grade(self):
+        if self.grade is not None:
+            return self.grade
+        if self.solution.task.type == Task.TEXT:
+            return 0
         if self.choice_answer == self.solution.choice_answer and self.submit:
             return self.solution.points
         else:
             return 0
+
+
+class ExamSheetGrade(models.Model):
+    exam_sheet = models.ForeignKey(ExamSheet,
+                                   related_name='grades',
+                                   on_delete=models.CASCADE)
+    user = models.ForeignKey(User,
+                             related_name='exam_sheet_grades',
+                             on_delete=models.CASCADE)
+    final_grade = models.IntegerField(default=0)
+    edited = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('exam_sheet', 'user'),)
+
+    def __str__(self):
+        return f'{self.exam_sheet_id}-{self.user_id}: {self.final_grade}'
+
+    @classmethod
+    def refresh(cls, pairs):
+        """
+        Recalculate stored final grades of given `(exam_sheet_id, user_id)` pairs.
+        """
+        pairs = set(pairs)
+        exam_sheets = {pk: (template, creator_id) for pk, template, creator_id in ExamSheet.objects.filter(
+            pk__in={exam_sheet_id for exam_sheet_id, _ in pairs}).values_list('pk', 'template', 'creator')}
+        final_grades = ExamSheet.get_final_grades(
+            (exam_sheet_id, user_id) for exam_sheet_id, user_id in pairs
+            if exam_sheet_id in exam_sheets and (exam_sheets[exam_sheet_id][0]
+                                                 or exam_sheets[exam_sheet_id][1] == user_id))
+        if not final_grades:
+            return
+        stored = cls.objects.filter(exam_sheet__in={exam_sheet_id for exam_sheet_id, _ in final_grades},
+                                    user__in={user_id for _, user_id in final_grades})
+        stored = {(grade.exam_sheet_id, grade.user_id): grade for grade in stored
+                  if (grade.exam_sheet_id, grade.user_id) in final_grades}
+        changed = []
+        now = timezone.now()
+        for key, grade in stored.items():
+            if grade.final_grade != final_grades[key]:
+                grade.final_grade = final_grades[key]
+                grade.edited = now
+                changed.append(grade)
+        cls.objects.bulk_update(changed, ['final_grade', 'edited'])
+        cls.objects.bulk_create([cls(exam_sheet_id=exam_sheet_id, user_id=user_id, final_grade=final_grade)
+                                 for (exam_sheet_id, user_id), final_grade in final_grades.items()
+                                 if (exam_sheet_id, user_id) not in stored],
+                                ignore_conflicts=True)
+
+
+class GradingJob(models.Model):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    DONE = 'DONE'
+    FAILED = 'FAILED'
+
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    answer = models.ForeignKey(Answer,
+                               related_name='grading_jobs',
+                               on_delete=models.CASCADE)
+    status = models.CharField(choices=STATUS_CHOICES,
+                              default=PENDING,
+                              max_length=16)
+    worker = models.CharField(max_length=64,
+                              null=True,
+                              default=None)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(null=True,
+                             default=None)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True,
+                                   default=None)
+    finished = models.DateTimeField(null=True,
+                                    default=None)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id'], name='sheets_grading_job_status_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.answer_id}: {self.status}'
@@ -0,0 +1,29 @@
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.pagination import CursorPagination
+
+
+class SheetsCursorPagination(CursorPagination):
+    """
+    Cursor pagination over the `OrderingFilter` fields of a view. Related fields are positioned by their `_id`
+    column and the primary key breaks ties, so cursors hold plain values and rows keep a stable order.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def get_ordering(self, request, queryset, view):
+        opts = queryset.model._meta
+        ordering = []
+        for field_name in super().get_ordering(request, queryset, view):
+            prefix, name = ('-', field_name[1:]) if field_name.startswith('-') else ('', field_name)
+            try:
+                field = opts.get_field(name)
+            except FieldDoesNotExist:
+                pass
+            else:
+                if field.many_to_one or field.one_to_one:
+                    name = field.attname
+            ordering.append(prefix + name)
+        if not any(field_name.lstrip('-') in ('pk', opts.pk.attname) for field_name in ordering):
+            ordering.append(('-' if ordering[0].startswith('-') else '') + opts.pk.attname)
+        return tuple(ordering)
@@ -8,7 +8,9 @@ class IsObjectOwnerPermissions(BasePermission):
         Return `True` if permission is granted, `False` otherwise.
         """
         if obj.creator == request.user and (view.action == 'partial_update'
-                                            or view.action == 'perform_destroy'):
+                                            or view.action == 'perform_destroy'
+                                            or view.action == 'regrade'
+                                            or view.action == 'statistics'):
             return True
         if view.action == 'retrieve' or view.action == 'list':
             return True
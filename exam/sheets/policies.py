@@ -0,0 +1,56 @@
+"""
+Rows a user may see, expressed as queryset filters shared by list, detail and nested representations.
+
+Superusers see everything. Other users see templates and their own exams, tasks and solutions of those,
+their own answers and answers to tasks they authored, and grades of their own or of their exam sheets.
+"""
+from django.db.models import Q
+
+from sheets.models import Answer, ExamSheet, ExamSheetGrade, GradingJob, Solution, Task
+
+
+def is_unrestricted(user):
+    return user.is_superuser
+
+
+def visible_exam_sheets(user, queryset=None):
+    queryset = ExamSheet.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    return queryset.filter(Q(template=True) | Q(creator=user))
+
+
+def visible_tasks(user, queryset=None):
+    queryset = Task.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    exam_sheet_tasks = Task.exam_sheet.through.objects.filter(examsheet__in=visible_exam_sheets(user))
+    return queryset.filter(Q(creator=user) | Q(pk__in=exam_sheet_tasks.values('task')))
+
+
+def visible_solutions(user, queryset=None):
+    queryset = Solution.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    return queryset.filter(Q(creator=user) | Q(task__in=visible_tasks(user)))
+
+
+def visible_answers(user, queryset=None):
+    queryset = Answer.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    return queryset.filter(Q(creator=user) | Q(task__creator=user))
+
+
+def visible_grades(user, queryset=None):
+    queryset = ExamSheetGrade.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    return queryset.filter(Q(user=user) | Q(exam_sheet__creator=user))
+
+
+def visible_grading_jobs(user, queryset=None):
+    queryset = GradingJob.objects.all() if queryset is None else queryset
+    if is_unrestricted(user):
+        return queryset
+    return queryset.filter(answer__in=visible_answers(user))
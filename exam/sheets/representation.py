@@ -0,0 +1,53 @@
+from collections import OrderedDict
+from operator import attrgetter
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import ManyRelatedField, PKOnlyObject
+
+
+def _pk_getter(source):
+    return lambda instance: instance.serializable_value(source)
+
+
+class FastRepresentationMixin:
+    """
+    Render instances through getters planned once per serializer instead of resolving every field
+    for every row. Plain attributes are read directly and related primary keys from their `_id` columns,
+    nested serializers, many related and method fields still go through DRF.
+    """
+
+    @cached_property
+    def _representation_plan(self):
+        plan = []
+        for field in self._readable_fields:
+            if isinstance(field, (serializers.BaseSerializer, ManyRelatedField, serializers.SerializerMethodField,
+                                  serializers.HiddenField)) or len(field.source_attrs) != 1:
+                plan.append((field.field_name, field.get_attribute, field.to_representation))
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                plan.append((field.field_name, _pk_getter(field.source), None))
+            elif isinstance(field, serializers.RelatedField):
+                plan.append((field.field_name, field.get_attribute, field.to_representation))
+            else:
+                plan.append((field.field_name, attrgetter(field.source), field.to_representation))
+        return plan
+
+    def to_representation(self, instance):
+        if not settings.SHEETS_FAST_REPRESENTATION:
+            return super().to_representation(instance)
+        ret = OrderedDict()
+        for name, get_attribute, to_representation in self._representation_plan:
+            try:
+                attribute = get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            if check_for_none is None:
+                ret[name] = None
+            elif to_representation is None:
+                ret[name] = attribute
+            else:
+                ret[name] = to_representation(attribute)
+        return ret
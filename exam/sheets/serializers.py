@@ -1,14 +1,25 @@
+import re
+
+from django.db import connection, transaction
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from sheets.models import ExamSheet, Task, Answer, Solution
+from sheets import grading
+from sheets.cache import bump_exam_sheet_versions
+from sheets.instrumentation import TimedRepresentationMixin
+from sheets.models import ExamSheet, Task, Answer, Solution, ExamSheetGrade, GradingJob
+from sheets.representation import FastRepresentationMixin
+from sheets.sparse import SparseFieldsMixin
 
 
-class AnswerSerializer(serializers.ModelSerializer):
+class AnswerSerializer(TimedRepresentationMixin, SparseFieldsMixin, FastRepresentationMixin,
+                       serializers.ModelSerializer):
     class Meta:
         model = Answer
         fields = ('id', 'task', 'grade', 'choice_answer', 'text_answer', 'submit', 'solution', 'calculated_grade')
-        read_only_fields = ('id',)
+        read_only_fields = ('id', 'grade')
+
+    graded_fields = ('choice_answer', 'text_answer', 'submit', 'solution')
 
     def validate(self, attrs):
         if self.context['request'].method == 'POST' and attrs['task'] != attrs['solution'].task:
@@ -20,40 +31,136 @@ class AnswerSerializer(serializers.ModelSerializer):
             raise ValidationError('You can not answer twice on the same solution')
         return solution
 
+    @transaction.atomic
     def create(self, validated_data):
         answer = super().create(validated_data)
-        if not ExamSheet.objects.filter(creator=self.context['request'].user, template=False).exists():
-            self._create_exam_based_on_template(answer)
-        else:
-            self._add_task_to_existing_exam(answer)
+        template_exam = answer.task.exam_sheet.filter(template=True).order_by('pk').first()
+        if template_exam is None:
+            raise ValidationError('Answered task does not belong to any exam template')
+        exam_sheet, created = template_exam.get_or_create_instance(self.context['request'].user)
+        if not created and not exam_sheet.tasks.filter(pk=answer.task_id).exists():
+            # Tasks added to the template after the exam started are linked once answered.
+            exam_sheet.tasks.add(answer.task_id)
         return answer
 
-    def _create_exam_based_on_template(self, answer):
-        template_exam = answer.task.exam_sheet.filter(template=True).first()
-        template_exam.pk = None
-        template_exam.template = False
-        template_exam.save()
-        template_exam.tasks.add(answer.task.id)
-        template_exam.creator = self.context['request'].user
-        template_exam.save()
+    def update(self, instance, validated_data):
+        if any(field in validated_data and validated_data[field] != getattr(instance, field)
+               for field in self.graded_fields):
+            # The stored grade judged the previous answer, fall back to the calculated one until regraded.
+            validated_data['grade'] = None
+        return super().update(instance, validated_data)
+
+
+class GradingJobSerializer(SparseFieldsMixin, FastRepresentationMixin, serializers.ModelSerializer):
+    class Meta:
+        model = GradingJob
+        fields = ('id', 'answer', 'status', 'attempts', 'error', 'created', 'started', 'finished')
+        read_only_fields = fields
+
+
+class BulkAnswerItemSerializer(serializers.ModelSerializer):
+    task = serializers.IntegerField()
+    solution = serializers.IntegerField()
+
+    class Meta:
+        model = Answer
+        fields = ('task', 'choice_answer', 'text_answer', 'submit', 'solution')
+
+
+class BulkAnswerSerializer(serializers.Serializer):
+    answers = BulkAnswerItemSerializer(many=True, allow_empty=False)
+
+    def validate_answers(self, answers):
+        user = self.context['request'].user
+        solution_ids = [answer['solution'] for answer in answers]
+        solutions = Solution.objects.in_bulk(solution_ids)
+        answered = set(Answer.objects.filter(creator=user, solution__in=solution_ids).values_list('solution',
+                                                                                                   flat=True))
+        errors = []
+        seen = set()
+        for answer in answers:
+            solution = solutions.get(answer['solution'])
+            if solution is None:
+                errors.append({'solution': ['Solution does not exist']})
+            elif answer['task'] != solution.task_id:
+                errors.append({'non_field_errors': ['you chose wrong solution']})
+            elif solution.pk in answered or solution.pk in seen:
+                errors.append({'solution': ['You can not answer twice on the same solution']})
+            else:
+                errors.append({})
+            seen.add(answer['solution'])
+        if any(errors):
+            raise ValidationError(errors)
+        return answers
+
+    @transaction.atomic
+    def create(self, validated_data):
+        user = self.context['request'].user
+        answers = [Answer(creator=user,
+                          task_id=answer.pop('task'),
+                          solution_id=answer.pop('solution'),
+                          **answer)
+                   for answer in validated_data['answers']]
+        Answer.objects.bulk_create(answers)
+        task_ids = {answer.task_id for answer in answers}
+        exams = list(self._get_or_create_exams(task_ids))
+        ExamSheet.tasks.through.objects.bulk_create(
+            [ExamSheet.tasks.through(examsheet_id=exam_sheet.pk, task_id=task_id) for exam_sheet, task_id in exams],
+            ignore_conflicts=True)
+        exam_sheet_ids = set(ExamSheet.objects.counting_answers_of(user, task_ids).values_list('pk', flat=True))
+        ExamSheet.objects.filter(pk__in={exam_sheet.pk for exam_sheet, _ in exams}).refresh_totals()
+        bump_exam_sheet_versions(exam_sheet_ids)
+        ExamSheetGrade.refresh((exam_sheet_id, user.pk) for exam_sheet_id in exam_sheet_ids)
+        answers = Answer.objects.filter(creator=user,
+                                        solution__in=[answer.solution_id for answer in answers])
+        answers = answers.select_related('solution__task')
+        grading.enqueue(answers)
+        return answers
+
+    def _get_or_create_exams(self, task_ids):
+        """
+        Yield `(exam instance, task id)` pairs, using the user's instance of each task's first template.
+        """
+        task_templates = {}
+        for task_id, template_id in ExamSheet.tasks.through.objects.filter(
+                task__in=task_ids, examsheet__template=True).order_by('-examsheet').values_list('task', 'examsheet'):
+            task_templates[task_id] = template_id
+        if task_ids - task_templates.keys():
+            raise ValidationError('Answered tasks do not belong to any exam template')
+        templates = ExamSheet.objects.in_bulk(set(task_templates.values()))
+        exam_sheets = {template_id: template.get_or_create_instance(self.context['request'].user)[0]
+                       for template_id, template in templates.items()}
+        for task_id, template_id in task_templates.items():
+            yield exam_sheets[template_id], task_id
+
+
+class GradingStrategyMixin:
+    def validate_grading(self, value):
+        if value is not None and value not in grading.get_strategies():
+            raise ValidationError(f'Unknown grading strategy: {value}')
+        return value
 
-    def _add_task_to_existing_exam(self, answer):
-        exam_sheet = ExamSheet.objects.get(creator=self.context['request'].user, template=False)
-        exam_sheet.tasks.add(answer.task.id)
-        exam_sheet.save()
+    def validate(self, attrs):
+        if attrs.get('grading', getattr(self.instance, 'grading', None)) == 'regex':
+            try:
+                grading.get_matcher('regex', attrs.get('text_answer', getattr(self.instance, 'text_answer', None)))
+            except re.error as error:
+                raise ValidationError({'text_answer': [f'Invalid regular expression: {error}']})
+        return super().validate(attrs)
 
 
-class SolutionSerializer(serializers.ModelSerializer):
+class SolutionSerializer(TimedRepresentationMixin, SparseFieldsMixin, FastRepresentationMixin,
+                         GradingStrategyMixin, serializers.ModelSerializer):
     answer = AnswerSerializer(read_only=True, many=True)
 
     class Meta:
         model = Solution
-        fields = ('task', 'choice_answer', 'text_answer', 'answer', 'points')
+        fields = ('task', 'choice_answer', 'text_answer', 'answer', 'points', 'grading')
 
     def validate(self, attrs):
         if attrs['task'].creator != self.context['request'].user:
             raise ValidationError('You can not create solution to task that is not yours')
-        return attrs
+        return super().validate(attrs)
 
     def validate_task(self, task):
         if task.type != Task.MULTI_CHOICE and task.related_solutions.all().exists():
@@ -61,7 +168,8 @@ class SolutionSerializer(serializers.ModelSerializer):
         return task
 
 
-class TaskSerializer(serializers.ModelSerializer):
+class TaskSerializer(TimedRepresentationMixin, SparseFieldsMixin, FastRepresentationMixin,
+                     serializers.ModelSerializer):
     related_solutions = SolutionSerializer(many=True, read_only=True)
 
     class Meta:
@@ -77,13 +185,65 @@ class TaskSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class ExamSheetSerializer(serializers.ModelSerializer):
+class ExamSheetSerializer(TimedRepresentationMixin, SparseFieldsMixin, FastRepresentationMixin,
+                          serializers.ModelSerializer):
     tasks = TaskSerializer(many=True, read_only=True)
 
     class Meta:
         model = ExamSheet
-        fields = ('id', 'created', 'edited', 'creator', 'editor', 'name', 'tasks', 'template')
-        read_only_fields = ('id', 'created', 'edited', 'creator', 'editor', 'your_final_grade', 'tasks')
+        fields = ('id', 'created', 'edited', 'creator', 'editor', 'name', 'tasks', 'template', 'task_count',
+                  'max_score')
+        read_only_fields = ('id', 'created', 'edited', 'creator', 'editor', 'your_final_grade', 'tasks', 'task_count',
+                            'max_score')
 
     def get_your_final_grade(self, obj):
         return obj.get_user_final_grade(self.context['request'].user)
+
+
+class ImportSolutionSerializer(GradingStrategyMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Solution
+        fields = ('text_answer', 'choice_answer', 'points', 'grading')
+
+
+class ImportTaskSerializer(serializers.ModelSerializer):
+    solutions = ImportSolutionSerializer(many=True, required=False)
+
+    class Meta:
+        model = Task
+        fields = ('question', 'type', 'max_grade', 'solutions')
+
+    def validate(self, attrs):
+        if attrs.get('type', Task.TEXT) != Task.MULTI_CHOICE and len(attrs.get('solutions', [])) > 1:
+            raise ValidationError('You cant assign more than two solutions to this type of task')
+        return attrs
+
+
+class TemplateImportSerializer(serializers.ModelSerializer):
+    tasks = ImportTaskSerializer(many=True, allow_empty=False)
+
+    class Meta:
+        model = ExamSheet
+        fields = ('name', 'tasks')
+
+    @transaction.atomic
+    def create(self, validated_data):
+        tasks_data = validated_data.pop('tasks')
+        exam_sheet = ExamSheet.objects.create(template=True, **validated_data)
+        tasks = [Task(creator=exam_sheet.creator,
+                      **{key: value for key, value in task_data.items() if key != 'solutions'})
+                 for task_data in tasks_data]
+        if connection.features.can_return_ids_from_bulk_insert:
+            Task.objects.bulk_create(tasks)
+        else:
+            for task in tasks:
+                task.save()
+        Task.exam_sheet.through.objects.bulk_create(
+            [Task.exam_sheet.through(examsheet_id=exam_sheet.pk, task_id=task.pk) for task in tasks])
+        solutions = Solution.objects.bulk_create([Solution(creator=exam_sheet.creator, task=task, **solution_data)
+                                                  for task, task_data in zip(tasks, tasks_data)
+                                                  for solution_data in task_data.get('solutions', [])])
+        exam_sheet.task_count = len(tasks)
+        exam_sheet.max_score = sum(solution.points or 0 for solution in solutions)
+        exam_sheet.save(update_fields=['task_count', 'max_score'])
+        return exam_sheet
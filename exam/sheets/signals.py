@@ -0,0 +1,108 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from sheets import grading
+from sheets.cache import bump_exam_sheet_versions
+from sheets.models import Answer, ExamSheet, ExamSheetGrade, Solution, Task
+
+TaskExamSheets = Task.exam_sheet.through
+
+
+def _exam_sheet_ids(task_ids):
+    return set(TaskExamSheets.objects.filter(task__in=task_ids).values_list('examsheet', flat=True))
+
+
+def _refresh_exam_sheets(exam_sheet_ids):
+    """
+    Refresh stored totals of exam sheets whose tasks or solutions changed and invalidate their representations.
+    """
+    if exam_sheet_ids:
+        ExamSheet.objects.filter(pk__in=exam_sheet_ids).refresh_totals()
+    bump_exam_sheet_versions(exam_sheet_ids)
+
+
+def _grade_pairs(exam_sheet_ids, answers):
+    user_ids = set(answers.values_list('creator', flat=True))
+    return {(exam_sheet_id, user_id) for exam_sheet_id in exam_sheet_ids for user_id in user_ids}
+
+
+@receiver(post_save, sender=ExamSheet)
+@receiver(post_delete, sender=ExamSheet)
+def exam_sheet_changed(sender, instance, **kwargs):
+    bump_exam_sheet_versions([instance.pk])
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def answer_changed(sender, instance, **kwargs):
+    exam_sheet_ids = set(ExamSheet.objects.counting_answers_of(instance.creator_id, [instance.task_id])
+                         .values_list('pk', flat=True))
+    bump_exam_sheet_versions(exam_sheet_ids)
+    ExamSheetGrade.refresh((exam_sheet_id, instance.creator_id) for exam_sheet_id in exam_sheet_ids)
+
+
+@receiver(post_save, sender=Answer)
+def answer_submitted(sender, instance, **kwargs):
+    grading.enqueue([instance])
+
+
+@receiver(post_save, sender=Solution)
+def solution_changed(sender, instance, created, **kwargs):
+    exam_sheet_ids = _exam_sheet_ids([instance.task_id])
+    _refresh_exam_sheets(exam_sheet_ids)
+    if not created:
+        answers = Answer.objects.filter(solution=instance)
+        answers.update(grade=None, edited=timezone.now())
+        ExamSheetGrade.refresh(_grade_pairs(exam_sheet_ids, answers))
+        grading.enqueue(answers.select_related(None).only('pk', 'submit'))
+
+
+@receiver(post_delete, sender=Solution)
+def solution_deleted(sender, instance, **kwargs):
+    _refresh_exam_sheets(_exam_sheet_ids([instance.task_id]))
+
+
+@receiver(post_save, sender=Task)
+def task_changed(sender, instance, created, **kwargs):
+    if not created:
+        bump_exam_sheet_versions(_exam_sheet_ids([instance.pk]))
+
+
+@receiver(pre_delete, sender=Task)
+def collect_task_exam_sheets(sender, instance, **kwargs):
+    instance._exam_sheet_ids = _exam_sheet_ids([instance.pk])
+    instance._grade_pairs = _grade_pairs(instance._exam_sheet_ids, Answer.objects.filter(task=instance))
+
+
+@receiver(post_delete, sender=Task)
+def task_deleted(sender, instance, **kwargs):
+    _refresh_exam_sheets(getattr(instance, '_exam_sheet_ids', ()))
+    ExamSheetGrade.refresh(getattr(instance, '_grade_pairs', ()))
+
+
+@receiver(m2m_changed, sender=TaskExamSheets)
+def task_exam_sheets_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('pre_clear', 'post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        exam_sheet_ids = {instance.pk}
+        task_ids = pk_set
+    else:
+        exam_sheet_ids = pk_set
+        task_ids = {instance.pk}
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_task_ids = set(instance.tasks.values_list('pk', flat=True))
+        else:
+            instance._cleared_exam_sheet_ids = set(instance.exam_sheet.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        if reverse:
+            task_ids = instance.__dict__.pop('_cleared_task_ids', set())
+        else:
+            exam_sheet_ids = instance.__dict__.pop('_cleared_exam_sheet_ids', set())
+    _refresh_exam_sheets(exam_sheet_ids)
+    # Every other sheet holding these tasks lists the sheets of each task.
+    bump_exam_sheet_versions(_exam_sheet_ids(task_ids) - exam_sheet_ids)
+    ExamSheetGrade.refresh(_grade_pairs(exam_sheet_ids, Answer.objects.filter(task__in=task_ids)))
@@ -0,0 +1,130 @@
+import hashlib
+import json
+
+from django.db.models import Prefetch
+from rest_framework import serializers
+
+
+def parse_paths(value):
+    """
+    Return comma separated dotted paths as a tree of `{name: subtree}`, or `None` when no path is given.
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        node = tree
+        for name in filter(None, (name.strip() for name in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree or None
+
+
+def _selects(tree, path):
+    for name in path:
+        if not tree:
+            return True
+        if name not in tree:
+            return False
+        tree = tree[name]
+    return True
+
+
+def _expands(tree, path):
+    if tree is None:
+        return True
+    for name in path:
+        if name not in tree:
+            return False
+        tree = tree[name]
+    return True
+
+
+class SparseFieldset:
+    """
+    Fields (`?fields=id,name,tasks.question`) and nested serializers (`?expand=tasks`) requested by a client.
+    Without `fields` every field is rendered, without `expand` every nested serializer is embedded,
+    nested serializers left out of `expand` are rendered as primary keys.
+    """
+
+    def __init__(self, fields=None, expand=None):
+        self.fields = parse_paths(fields)
+        self.expand = parse_paths(expand)
+        self.key = hashlib.sha1(json.dumps([self.fields, self.expand], sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def from_request(cls, request):
+        fields = request.query_params.get('fields')
+        expand = request.query_params.get('expand')
+        if fields is None and expand is None:
+            return None
+        return cls(fields, expand)
+
+    def prune_fields(self, path, fields):
+        """
+        Return serializer `fields` found at `path` of the representation that the client asked for.
+        """
+        pruned = {}
+        for name, field in fields.items():
+            if not _selects(self.fields, path + [name]):
+                continue
+            if isinstance(field, serializers.BaseSerializer) and not _expands(self.expand, path + [name]):
+                field = serializers.PrimaryKeyRelatedField(many=isinstance(field, serializers.ListSerializer),
+                                                           read_only=True,
+                                                           source=field.source)
+            pruned[name] = field
+        return pruned
+
+    def prune_lookup(self, lookup):
+        """
+        Return the leading part of a `__` separated `lookup` through fields that are still rendered, or `None`.
+        Lookups through nested serializers end at the first one rendered as primary keys.
+        """
+        kept = []
+        for name in lookup.split('__'):
+            if not _selects(self.fields, kept + [name]):
+                break
+            kept.append(name)
+            if not _expands(self.expand, kept):
+                break
+        return '__'.join(kept) or None
+
+    def prune_prefetches(self, lookups):
+        pruned = []
+        for lookup in lookups:
+            through = lookup.prefetch_through if isinstance(lookup, Prefetch) else lookup
+            kept = self.prune_lookup(through)
+            if kept == through:
+                pruned.append(lookup)
+            elif kept is not None and kept not in pruned:
+                pruned.append(kept)
+        return tuple(pruned)
+
+    def prune_counts(self, lookups):
+        """
+        Keep counted relation `lookups` that are all still rendered.
+        """
+        return tuple(lookup for lookup in lookups if self.prune_lookup(lookup) == lookup)
+
+    def prune_values(self, lookups):
+        """
+        Keep `lookups` of values (e.g. `tasks__edited`) whose relations are all still rendered.
+        """
+        return tuple(lookup for lookup in lookups if '__' not in lookup
+                     or self.prune_counts([lookup.rsplit('__', 1)[0]]))
+
+
+class SparseFieldsMixin:
+    """
+    Render only the part of the representation selected by the `sparse_fieldset` of the serializer context.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('sparse_fieldset')
+        if fieldset is None:
+            return fields
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+        return fieldset.prune_fields(path, fields)
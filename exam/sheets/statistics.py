@@ -0,0 +1,76 @@
+from django.db.models import Avg, Count, IntegerField, Max, Q, Value
+
+from sheets.models import Answer, ExamSheetGrade, Solution, Task
+
+
+def _rate(count, total):
+    return round(100 * count / total, 2) if total else None
+
+
+def exam_sheet_statistics_stamp(exam_sheet):
+    """
+    Return the number and last modification time of answers, solutions, tasks and final grades that statistics
+    of `exam_sheet` are computed from, read by one query, so cached statistics can be checked against them.
+    """
+    relations = (exam_sheet.get_answers(), Solution.objects.filter(task__exam_sheet=exam_sheet),
+                 Task.objects.filter(exam_sheet=exam_sheet), ExamSheetGrade.objects.filter(exam_sheet=exam_sheet))
+    stamps = [rows.order_by().values(relation=Value(index, output_field=IntegerField()))
+              .annotate(rows=Count('pk'), edited=Max('edited')).values_list('relation', 'rows', 'edited')
+              for index, rows in enumerate(relations)]
+    return exam_sheet.edited, sorted(stamps[0].union(*stamps[1:], all=True))
+
+
+def exam_sheet_statistics(exam_sheet):
+    """
+    Return task difficulty, solution pick rates and the final grade distribution of `exam_sheet`,
+    each computed by one grouped query over submitted answers.
+
+    Rates are per respondent: the share of users who submitted answers to a task and scored on it,
+    or who chose a solution. Exam instances only count answers of their taker.
+    """
+    answers = exam_sheet.get_answers().filter(submit=True).annotate(calculated=Answer.objects.calculated_grade())
+    picks = Q(answer__submit=True, answer__choice_answer=True)
+    if not exam_sheet.template:
+        picks &= Q(answer__creator=exam_sheet.creator_id)
+    task_answers = {row['task']: row for row in answers.order_by().values('task').annotate(
+        answers=Count('pk'),
+        respondents=Count('creator', distinct=True),
+        correct=Count('creator', distinct=True, filter=Q(calculated__gt=0)),
+        average_grade=Avg('calculated'))}
+    solutions = {}
+    for row in (Solution.objects.filter(task__exam_sheet=exam_sheet).order_by('pk').values('pk', 'task')
+                .annotate(picks=Count('answer', filter=picks))):
+        solutions.setdefault(row['task'], []).append(row)
+
+    tasks = []
+    for task in Task.objects.filter(exam_sheet=exam_sheet).order_by('pk').values('pk', 'question'):
+        stats = task_answers.get(task['pk'], {'answers': 0, 'respondents': 0, 'correct': 0, 'average_grade': None})
+        tasks.append({
+            'task': task['pk'],
+            'question': task['question'],
+            'answers': stats['answers'],
+            'respondents': stats['respondents'],
+            'correct': stats['correct'],
+            'percent_correct': _rate(stats['correct'], stats['respondents']),
+            'average_grade': stats['average_grade'],
+            'solutions': [{'solution': solution['pk'],
+                           'picks': solution['picks'],
+                           'pick_rate': _rate(solution['picks'], stats['respondents'])}
+                          for solution in solutions.get(task['pk'], ())],
+        })
+
+    distribution = list(ExamSheetGrade.objects.filter(exam_sheet=exam_sheet).order_by('final_grade')
+                        .values('final_grade').annotate(users=Count('user')))
+    participants = sum(row['users'] for row in distribution)
+    return {
+        'exam_sheet': exam_sheet.pk,
+        'participants': participants,
+        'final_grades': {
+            'average': (sum(row['final_grade'] * row['users'] for row in distribution) / participants
+                        if participants else None),
+            'min': distribution[0]['final_grade'] if distribution else None,
+            'max': distribution[-1]['final_grade'] if distribution else None,
+            'distribution': distribution,
+        },
+        'tasks': tasks,
+    }
@@ -1,11 +1,27 @@
 # Create your tests here.
 
 
+import json
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, connection, transaction
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.request import Request
 from rest_framework.test import APIClient, APISimpleTestCase
 
-from sheets.models import ExamSheet, Task, Solution, Answer
+from sheets import db, grading
+from sheets.db import ReadReplicaRouter
+from sheets.importers import import_template, parse_template_csv
+from sheets.instrumentation import registry
+from sheets.models import ExamSheet, Task, Solution, Answer, ExamSheetGrade, GradingJob
+from sheets.views import ExamSheetViewSet
 
 User = get_user_model()
 
@@ -34,49 +50,134 @@ class ExamViewsTest(APISimpleTestCase):
         self.client.force_authenticate(self.superuser)
         response = self.client.post(self.exam_list_url, {"name": "exam_template",
                                                          "template": True})
-        self.assertEqual(len(response.data.keys()), 8)
+        self.assertEqual(len(response.data.keys()), 10)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(ExamSheet.objects.all().count(), start_amount + 1)
         response = self.client.post(self.exam_list_url, {"name": "exam_template2",
                                                          "template": True})
-        self.assertEqual(len(response.data.keys()), 8)
+        self.assertEqual(len(response.data.keys()), 10)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(ExamSheet.objects.all().count(), start_amount + 2)
 
     def test_list_exam(self):
         self.client.force_authenticate(self.superuser)
-        response = self.client.get(self.exam_list_url)
-        amount = len(response.data)
-        self.assertEqual(len(response.data), amount)
+        response = self.client.get(self.exam_list_url, {'page_size': 1000})
+        amount = len(response.data['results'])
+        self.assertEqual(len(response.data['results']), amount)
         self.client.post(self.exam_list_url, {"name": "exam_template3",
                                               "template": True})
-        response = self.client.get(self.exam_list_url)
-        self.assertEqual(len(response.data), amount + 1)
+        response = self.client.get(self.exam_list_url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), amount + 1)
 
     def test_exams_view(self):
         self.client.force_authenticate(self.superuser)
         start_amount = ExamSheet.objects.filter(template=False).count()
-        response = self.client.get(self.exams_list_url)
+        response = self.client.get(self.exams_list_url, {'page_size': 1000})
 
-        self.assertEqual(len(response.data), start_amount)
+        self.assertEqual(len(response.data['results']), start_amount)
 
         self.client.post(self.exam_list_url, {"name": "exam1",
                                               "template": False})
-        response = self.client.get(self.exams_list_url)
-        self.assertEqual(len(response.data), start_amount + 1)
+        response = self.client.get(self.exams_list_url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), start_amount + 1)
 
     def test_template_view(self):
         start_amount = ExamSheet.objects.filter(template=True).count()
         self.client.force_authenticate(self.superuser)
-        response = self.client.get(self.templates_list_url)
+        response = self.client.get(self.templates_list_url, {'page_size': 1000})
 
-        self.assertEqual(len(response.data), start_amount)
+        self.assertEqual(len(response.data['results']), start_amount)
 
         self.client.post(self.exam_list_url, {"name": "exam1",
                                               "template": True})
-        response = self.client.get(self.templates_list_url)
-        self.assertEqual(len(response.data), start_amount + 1)
+        response = self.client.get(self.templates_list_url, {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), start_amount + 1)
+
+    def test_stream_ndjson(self):
+        self.client.force_authenticate(self.superuser)
+        self.client.post(self.exam_list_url, {"name": "streamed",
+                                              "template": True})
+        for url, expected in ((self.exam_list_url, ExamSheet.objects.all()),
+                              (self.templates_list_url, ExamSheet.objects.filter(template=True))):
+            with mock.patch.object(ExamSheetViewSet, 'stream_chunk_size', 2), \
+                    mock.patch.object(ExamSheetViewSet, 'get_freshness') as get_freshness:
+                response = self.client.get(url, {'output': 'ndjson'})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+                self.assertNotIn('ETag', response)
+                rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            get_freshness.assert_not_called()
+            self.assertEqual([row['id'] for row in rows], list(expected.order_by('id').values_list('id', flat=True)))
+            self.assertEqual(len(rows[0]), 10)
+
+    def test_cursor_pagination(self):
+        self.client.force_authenticate(self.superuser)
+        author = User.objects.create_user('paged_author', 'paged@author.com', 'TajneHaslo')
+        for name, creator in (('paged_b', self.superuser), ('paged_a', author), ('paged_c', author)):
+            ExamSheet.objects.create(name=name, template=True, creator=creator)
+
+        for field in ExamSheetViewSet.ordering_fields:
+            for ordering in (field, f'-{field}'):
+                column = 'creator_id' if field == 'creator' else field
+                expected = list(ExamSheet.objects.filter(template=True)
+                                .order_by(ordering.replace(field, column), '-id' if ordering[0] == '-' else 'id')
+                                .values_list('id', flat=True))
+                ids = []
+                response = self.client.get(self.templates_list_url, {'page_size': 2, 'ordering': ordering})
+                while True:
+                    self.assertEqual(response.status_code, 200, ordering)
+                    self.assertLessEqual(len(response.data['results']), 2)
+                    ids.extend(exam['id'] for exam in response.data['results'])
+                    if not response.data['next']:
+                        break
+                    response = self.client.get(response.data['next'])
+                self.assertEqual(ids, expected, ordering)
 
+    def test_import_template(self):
+        self.client.force_authenticate(self.superuser)
+        document = {'name': 'imported',
+                    'tasks': [{'question': 'how old are you?',
+                               'type': 'MULTI_CHOICE',
+                               'solutions': [{'text_answer': '18', 'choice_answer': True, 'points': 2},
+                                             {'text_answer': '81', 'choice_answer': False}]},
+                              {'question': 'name?',
+                               'type': 'TEXT',
+                               'solutions': [{'text_answer': 'Test'}]}]}
+        response = self.client.post(f'{self.exam_list_url}import/', document, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        exam_sheet = ExamSheet.objects.get(pk=response.data['id'])
+        self.assertTrue(exam_sheet.template)
+        self.assertEqual(exam_sheet.tasks.count(), 2)
+        self.assertEqual(Solution.objects.filter(task__exam_sheet=exam_sheet).count(), 3)
+        self.assertEqual((exam_sheet.task_count, exam_sheet.max_score), (2, 4))
+        self.assertEqual((response.data['task_count'], response.data['max_score']), (2, 4))
+
+    def test_import_template_errors(self):
+        self.client.force_authenticate(self.superuser)
+        start_amount = ExamSheet.objects.all().count()
+        document = {'name': 'imported',
+                    'tasks': [{'question': 'ok?', 'type': 'TEXT'},
+                              {'question': 'wrong type', 'type': 'ESSAY'},
+                              {'question': 'two solutions', 'type': 'TEXT',
+                               'solutions': [{'text_answer': 'a'}, {'text_answer': 'b'}]}]}
+        response = self.client.post(f'{self.exam_list_url}import/', document, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['tasks'][0], {})
+        self.assertIn('type', response.data['tasks'][1])
+        self.assertIn('non_field_errors', response.data['tasks'][2])
+        self.assertEqual(ExamSheet.objects.all().count(), start_amount)
+
+    def test_import_template_csv(self):
+        lines = StringIO('question,type,text_answer,choice_answer,points\n'
+                         'how old are you?,MULTI_CHOICE,18,true,2\n'
+                         'how old are you?,MULTI_CHOICE,81,false,1\n'
+                         'name?,TEXT,Test,,\n')
+        document = parse_template_csv(lines, 'imported csv')
+        exam_sheet = import_template(document, self.superuser)
+        self.assertEqual(exam_sheet.tasks.count(), 2)
+        self.assertEqual(Solution.objects.filter(task__exam_sheet=exam_sheet).count(), 3)
 
 class TaskViewsTest(APISimpleTestCase):
     allow_database_queries = True
@@ -147,16 +248,21 @@ class SolutionViewsTest(APISimpleTestCase):
                                                              'choice_answer': False,
                                                              'points': 2})
 
-        self.assertEqual(len(response.data.keys()), 5)
+        self.assertEqual(len(response.data.keys()), 6)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(Solution.objects.all().count(), start_amount + 1)
         response = self.client.post(self.solution_list_url, {"task": self.task.pk,
                                                              "text_answer": "respo2nse",
                                                              'choice_answer': False,
                                                              'points': 2})
-        self.assertEqual(len(response.data.keys()), 5)
+        self.assertEqual(len(response.data.keys()), 6)
         self.assertEqual(response.status_code, 201)
         self.assertEqual(Solution.objects.all().count(), start_amount + 2)
+        response = self.client.post(self.solution_list_url, {"task": self.task.pk,
+                                                             "text_answer": "response(",
+                                                             'grading': 'regex'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('text_answer', response.data)
 
 
 class AnswerViewsTest(APISimpleTestCase):
@@ -214,6 +320,205 @@ class AnswerViewsTest(APISimpleTestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(Answer.objects.all().count(), start_amount + 2)
 
+    def test_bulk_create_answers(self):
+        student = User.objects.create_user('bulk_student', 'bulk@student.com', 'TajneHaslo')
+        self.client.force_authenticate(student)
+        payload = {'answers': [{'task': self.task.pk, 'solution': self.solution.pk,
+                                'choice_answer': False, 'submit': True},
+                               {'task': self.task.pk, 'solution': self.solution2.pk,
+                                'choice_answer': True, 'submit': True}]}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(f'{self.answer_list_url}bulk/', payload, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual([answer['calculated_grade'] for answer in response.data], [5, 0])
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('SELECT') and 'FROM "sheets_task" WHERE' in query['sql']])
+        exam = ExamSheet.objects.get(creator=student, template=False)
+        self.assertEqual(list(exam.tasks.all()), [self.task])
+        self.assertEqual(exam.get_user_final_grade(student), 5)
+
+        response = self.client.post(f'{self.answer_list_url}bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Answer.objects.filter(creator=student).count(), 2)
+
+    def test_export_answers(self):
+        self.client.force_authenticate(self.superuser)
+        Answer.objects.create(task=self.task,
+                              creator=self.superuser,
+                              choice_answer=False,
+                              solution=self.solution,
+                              submit=True)
+        response = self.client.get(f'{self.answer_list_url}export/', {'output': 'csv',
+                                                                     'exam_sheet': self.exam_sheet.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'creator', 'task'])
+        self.assertEqual(len(lines), 2)
+
+        response = self.client.get(f'{self.answer_list_url}export/', {'type': 'grades',
+                                                                     'exam_sheet': self.exam_sheet.pk})
+        grades = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(grades, [{'exam_sheet': self.exam_sheet.pk,
+                                   'user': self.superuser.pk,
+                                   'final_grade': 5,
+                                   'edited': grades[0]['edited']}])
+
+        response = self.client.get(f'{self.answer_list_url}export/', {'exam_sheet': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_one_exam_per_template(self):
+        student = User.objects.create_user('template_student', 'template@student.com', 'TajneHaslo')
+        self.client.force_authenticate(student)
+        other_template = ExamSheet.objects.create(template=True,
+                                                  name='template2',
+                                                  creator=self.superuser)
+        other_task = Task.objects.create(type='MULTI_CHOICE',
+                                         creator=self.superuser)
+        other_task.exam_sheet.add(other_template)
+        other_solution = Solution.objects.create(task=other_task,
+                                                 points=1,
+                                                 creator=self.superuser)
+
+        for task, solution in ((self.task, self.solution), (self.task, self.solution2), (other_task, other_solution)):
+            response = self.client.post(self.answer_list_url, {'task': task.pk,
+                                                               'solution': solution.pk,
+                                                               'submit': True})
+            self.assertEqual(response.status_code, 201)
+
+        exams = ExamSheet.objects.filter(creator=student, template=False)
+        self.assertEqual({exam.origin_id for exam in exams}, {self.exam_sheet.pk, other_template.pk})
+        self.assertEqual(self.exam_sheet.get_or_create_instance(student),
+                         (exams.get(origin=self.exam_sheet), False))
+
+    def test_instance_copies_template_tasks(self):
+        def start_exam(size):
+            template = ExamSheet.objects.create(template=True, name=f'template-{size}', creator=self.superuser)
+            for _ in range(size):
+                task = Task.objects.create(type='MULTI_CHOICE', creator=self.superuser)
+                task.exam_sheet.add(template)
+                Solution.objects.create(task=task, points=2, creator=self.superuser)
+            template.refresh_from_db()
+            student = User.objects.create_user(f'instance_student_{size}', f'{size}@student.com', 'TajneHaslo')
+            with CaptureQueriesContext(connection) as context:
+                exam, created = template.get_or_create_instance(student)
+            self.assertTrue(created)
+            self.assertEqual(set(exam.tasks.values_list('pk', flat=True)),
+                             set(template.tasks.values_list('pk', flat=True)))
+            self.assertEqual((exam.task_count, exam.max_score), (size, 2 * size))
+            self.assertEqual(ExamSheetGrade.objects.get(exam_sheet=exam, user=student).final_grade, 0)
+            return len(context.captured_queries)
+
+        self.assertEqual(start_exam(1), start_exam(5))
+
+    def test_answer_cost_does_not_grow_with_cohort(self):
+        def answer(cohort):
+            template = ExamSheet.objects.create(template=True, name=f'cohort-{cohort}', creator=self.superuser)
+            tasks = [Task.objects.create(type='MULTI_CHOICE', creator=self.superuser) for _ in range(2)]
+            solutions = []
+            for task in tasks:
+                task.exam_sheet.add(template)
+                solutions.append(Solution.objects.create(task=task, points=2, creator=self.superuser))
+            template.refresh_from_db()
+            for number in range(cohort + 1):
+                student = User.objects.create_user(f'cohort_{cohort}_{number}', f'{cohort}_{number}@student.com',
+                                                   'TajneHaslo')
+                template.get_or_create_instance(student)
+            self.client.force_authenticate(student)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.post(self.answer_list_url, {'task': tasks[0].pk, 'solution': solutions[0].pk,
+                                                                   'choice_answer': False, 'submit': True})
+                self.assertEqual(response.status_code, 201)
+                response = self.client.post(f'{self.answer_list_url}bulk/',
+                                            {'answers': [{'task': tasks[1].pk, 'solution': solutions[1].pk,
+                                                          'choice_answer': False, 'submit': True}]}, format='json')
+                self.assertEqual(response.status_code, 201)
+            self.assertEqual(ExamSheet.objects.get(creator=student, template=False).get_user_final_grade(student), 4)
+            self.assertFalse([query for query in context.captured_queries
+                              if query['sql'].startswith('INSERT INTO "sheets_examsheet_tasks"')
+                              and 'ON CONFLICT' not in query['sql']])
+            return [query['sql'].count(',') for query in context.captured_queries]
+
+        self.assertEqual(answer(1), answer(6))
+
+    def test_grading_worker(self):
+        student = User.objects.create_user('graded_student', 'graded@student.com', 'TajneHaslo')
+        self.client.force_authenticate(student)
+        response = self.client.post(self.answer_list_url, {'task': self.task.pk,
+                                                           'solution': self.solution.pk,
+                                                           'choice_answer': False,
+                                                           'submit': True})
+        self.assertEqual(response.status_code, 201)
+        job = GradingJob.objects.get(answer=response.data['id'])
+        self.assertEqual(job.status, GradingJob.PENDING)
+
+        call_command('run_grading_worker', '--once', '--workers', '2', stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, GradingJob.DONE)
+        self.assertEqual(Answer.objects.get(pk=response.data['id']).grade, 5)
+        self.assertEqual(ExamSheetGrade.objects.get(exam_sheet=self.exam_sheet, user=student).final_grade, 5)
+
+        response = self.client.get('/grading_jobs/', {'answer': response.data['id']})
+        self.assertEqual([row['status'] for row in response.data['results']], [GradingJob.DONE])
+        self.assertEqual(self.client.post('/grading_jobs/', {}).status_code, 405)
+
+    def test_grade_is_not_writable(self):
+        student = User.objects.create_user('forging_student', 'forging@student.com', 'TajneHaslo')
+        self.client.force_authenticate(student)
+        response = self.client.post(self.answer_list_url, {'task': self.task.pk,
+                                                           'solution': self.solution.pk,
+                                                           'choice_answer': False,
+                                                           'submit': False,
+                                                           'grade': 1000})
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(Answer.objects.get(pk=response.data['id']).grade)
+        self.assertEqual(ExamSheetGrade.objects.get(exam_sheet=self.exam_sheet, user=student).final_grade, 0)
+        exam = ExamSheet.objects.get(origin=self.exam_sheet, creator=student)
+        self.assertEqual(ExamSheetGrade.objects.get(exam_sheet=exam, user=student).final_grade, 0)
+
+    def test_changed_answer_drops_stored_grade(self):
+        student = User.objects.create_user('changing_student', 'changing@student.com', 'TajneHaslo')
+        self.client.force_authenticate(student)
+        response = self.client.post(self.answer_list_url, {'task': self.task.pk,
+                                                           'solution': self.solution.pk,
+                                                           'choice_answer': False,
+                                                           'submit': True})
+        call_command('run_grading_worker', '--once', stdout=StringIO())
+        answer_url = f'{self.answer_list_url}{response.data["id"]}/'
+        self.assertEqual(self.client.get(answer_url).data['calculated_grade'], 5)
+
+        response = self.client.patch(answer_url, {'choice_answer': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['grade'])
+        self.assertEqual(response.data['calculated_grade'], 0)
+        self.assertEqual(ExamSheetGrade.objects.get(exam_sheet=self.exam_sheet, user=student).final_grade, 0)
+
+    def test_rows_are_scoped_to_user(self):
+        answers = {}
+        for username, solution in (('scoped_first', self.solution), ('scoped_second', self.solution2)):
+            student = User.objects.create_user(username, f'{username}@student.com', 'TajneHaslo')
+            self.client.force_authenticate(student)
+            response = self.client.post(self.answer_list_url, {'task': self.task.pk,
+                                                               'solution': solution.pk,
+                                                               'submit': True})
+            answers[username] = response.data['id']
+        first = User.objects.get(username='scoped_first')
+        self.client.force_authenticate(first)
+
+        response = self.client.get(self.answer_list_url, {'page_size': 1000})
+        self.assertEqual({answer['id'] for answer in response.data['results']}, {answers['scoped_first']})
+        self.assertEqual(self.client.get(f'{self.answer_list_url}{answers["scoped_second"]}/').status_code, 404)
+        exam_sheet = self.client.get(f'/exam_sheets/{self.exam_sheet.pk}/').data
+        self.assertEqual({answer['id'] for task in exam_sheet['tasks'] for solution in task['related_solutions']
+                          for answer in solution['answer']}, {answers['scoped_first']})
+        exams = self.client.get('/exam_sheets/exams/', {'page_size': 1000}).data['results']
+        self.assertEqual({exam['creator'] for exam in exams}, {first.pk})
+
+        self.client.force_authenticate(self.superuser)
+        response = self.client.get(self.answer_list_url, {'page_size': 1000})
+        self.assertTrue(set(answers.values()) <= {answer['id'] for answer in response.data['results']})
 
 class TestAnswerModel(APISimpleTestCase):
     allow_database_queries = True
@@ -259,6 +564,37 @@ class TestAnswerModel(APISimpleTestCase):
         self.assertEqual(self.answer.calculated_grade, 5)
         self.assertEqual(self.answer2.calculated_grade, 0)
 
+    def test_text_grading_strategies(self):
+        cases = (('exact', 'Warsaw', ' Warsaw ', 'warsaw'),
+                 ('normalized', 'Warsaw, Poland', 'warsaw  poland!', 'Warsaw'),
+                 ('token_set', 'red green blue yellow orange', 'orange yellow blue green red', 'red green'),
+                 ('regex', r'colou?r', 'Color', 'colours'))
+        for strategy, expected, correct, wrong in cases:
+            matcher = grading.get_matcher(strategy, expected)
+            self.assertIs(grading.get_matcher(strategy, expected), matcher)
+            self.assertTrue(matcher.matches(correct), strategy)
+            self.assertFalse(matcher.matches(wrong), strategy)
+
+        task = Task.objects.create(type=Task.TEXT, creator=self.superuser)
+        solution = Solution.objects.create(task=task, text_answer='Warsaw', points=3, grading='normalized',
+                                           creator=self.superuser)
+        answers = [Answer(task=task, solution=solution, text_answer=text_answer, submit=True)
+                   for text_answer in ('WARSAW.', 'Krakow')]
+        self.assertEqual([answer.grade for answer in grading.grade_answers(answers)], [3, 0])
+
+        exam_sheet = ExamSheet.objects.create(template=True, name='text template', creator=self.superuser)
+        task.exam_sheet.add(exam_sheet)
+        student = User.objects.create_user('text_student', 'text@student.com', 'TajneHaslo')
+        answer = Answer.objects.create(task=task, solution=solution, text_answer='Krakow', submit=True,
+                                       creator=student)
+        self.assertEqual(answer.calculated_grade, 0)
+        self.assertEqual(exam_sheet.get_user_final_grade(student), 0)
+        self.assertEqual(exam_sheet.calculate_user_final_grade(student), 0)
+        Answer.objects.filter(pk=answer.pk).update(text_answer='warsaw')
+        call_command('run_grading_worker', '--once', stdout=StringIO())
+        self.assertEqual(Answer.objects.get(pk=answer.pk).calculated_grade, 3)
+        self.assertEqual(exam_sheet.calculate_user_final_grade(student), 3)
+
 
 class TestExamSheetModel(APISimpleTestCase):
     allow_database_queries = True
@@ -304,6 +640,148 @@ class TestExamSheetModel(APISimpleTestCase):
         final_grade = self.exam_sheet.get_user_final_grade(self.superuser)
         self.assertEqual(final_grade, 5)
 
+    def test_get_final_grades(self):
+        other_sheet = ExamSheet.objects.create(template=True,
+                                               name='template2',
+                                               creator=self.superuser)
+        with CaptureQueriesContext(connection) as context:
+            final_grades = ExamSheet.get_final_grades([(self.exam_sheet.pk, self.superuser.pk),
+                                                       (other_sheet.pk, self.superuser.pk)])
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertEqual(final_grades, {(self.exam_sheet.pk, self.superuser.pk): 5,
+                                        (other_sheet.pk, self.superuser.pk): 0})
+
+    def test_stored_final_grade_follows_changes(self):
+        stored_grade = ExamSheetGrade.objects.get(exam_sheet=self.exam_sheet, user=self.superuser)
+        self.assertEqual(stored_grade.final_grade, 5)
+
+        self.solution.points = 7
+        self.solution.save()
+        stored_grade.refresh_from_db()
+        self.assertEqual(stored_grade.final_grade, 7)
+
+        self.answer2.choice_answer = False
+        self.answer2.save()
+        self.assertEqual(self.exam_sheet.get_user_final_grade(self.superuser), 11)
+
+    def test_one_exam_per_creator_and_template(self):
+        ExamSheet.objects.create(template=False,
+                                 name='exam',
+                                 origin=self.exam_sheet,
+                                 creator=self.superuser)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            ExamSheet.objects.create(template=False,
+                                     name='exam',
+                                     origin=self.exam_sheet,
+                                     creator=self.superuser)
+
+    def test_stored_totals_follow_changes(self):
+        def totals():
+            return ExamSheet.objects.values_list('task_count', 'max_score').get(pk=self.exam_sheet.pk)
+
+        self.assertEqual(totals(), (1, 9))
+        self.solution.points = 7
+        self.solution.save()
+        self.assertEqual(totals(), (1, 11))
+        other_task = Task.objects.create(type='TEXT', creator=self.superuser)
+        Solution.objects.create(task=other_task, text_answer='other', points=3, creator=self.superuser)
+        self.exam_sheet.tasks.add(other_task)
+        self.assertEqual(totals(), (2, 14))
+        self.solution2.delete()
+        self.assertEqual(totals(), (2, 10))
+        other_task.delete()
+        self.assertEqual(totals(), (1, 7))
+
+        ExamSheet.objects.filter(pk=self.exam_sheet.pk).update(task_count=0, max_score=0)
+        with self.assertRaises(CommandError):
+            call_command('check_exam_totals', stdout=StringIO())
+        call_command('check_exam_totals', '--fix', stdout=StringIO())
+        call_command('check_exam_totals', stdout=StringIO())
+        self.assertEqual(totals(), (1, 7))
+
+        client = APIClient()
+        client.force_authenticate(self.superuser)
+        response = client.get('/exam_sheets/', {'fields': 'id,task_count,max_score', 'max_score__gte': 7,
+                                                'ordering': '-max_score', 'page_size': 1000})
+        self.assertIn({'id': self.exam_sheet.pk, 'task_count': 1, 'max_score': 7}, response.data['results'])
+        self.assertTrue(all(row['max_score'] >= 7 for row in response.data['results']))
+
+    def test_rebuild_and_check_grades(self):
+        ExamSheetGrade.objects.filter(exam_sheet=self.exam_sheet).update(final_grade=100)
+        with self.assertRaises(CommandError):
+            call_command('check_grades', stdout=StringIO())
+        call_command('rebuild_grades', stdout=StringIO())
+        call_command('check_grades', stdout=StringIO())
+        self.assertEqual(self.exam_sheet.get_user_final_grade(self.superuser), 5)
+
+    def test_regrade(self):
+        Answer.objects.filter(pk=self.answer.pk).update(grade=1)
+        Solution.objects.filter(pk=self.solution.pk).update(points=8)
+        client = APIClient()
+        client.force_authenticate(self.superuser)
+        response = client.post(f'/solutions/{self.solution.pk}/regrade/')
+        self.assertEqual(response.data, {'regraded': 1})
+        self.assertEqual(Answer.objects.get(pk=self.answer.pk).grade, 8)
+        self.assertEqual(self.exam_sheet.get_user_final_grade(self.superuser), 8)
+
+        Solution.objects.filter(pk=self.solution2.pk).update(choice_answer=True)
+        out = StringIO()
+        call_command('regrade', '--exam-sheet', str(self.exam_sheet.pk), '--batch-size', '2', '--workers', '2',
+                     stdout=out)
+        self.assertIn('Regraded 2/2 answers', out.getvalue())
+        self.assertEqual(self.exam_sheet.get_user_final_grade(self.superuser), 12)
+
+        student = User.objects.create_user('regrade_student', 'regrade@student.com', 'TajneHaslo')
+        exam = self.exam_sheet.get_or_create_instance(student)[0]
+        Answer.objects.create(task=self.task, creator=student, choice_answer=True, solution=self.solution,
+                              submit=True)
+        client.force_authenticate(student)
+        response = client.post(f'/exam_sheets/{exam.pk}/regrade/')
+        self.assertEqual(response.data, {'regraded': 1})
+
+    def test_statistics(self):
+        client = APIClient()
+        client.force_authenticate(self.superuser)
+        url = f'/exam_sheets/{self.exam_sheet.pk}/statistics/'
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['participants'], 1)
+        self.assertEqual(response.data['final_grades']['distribution'], [{'final_grade': 5, 'users': 1}])
+        [task] = response.data['tasks']
+        self.assertEqual((task['answers'], task['respondents'], task['correct'], task['percent_correct']),
+                         (2, 1, 1, 100.0))
+        self.assertEqual([solution['pick_rate'] for solution in task['solutions']], [100.0, 100.0])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(client.get(url).data, response.data)
+        self.assertFalse([query for query in context.captured_queries if 'GROUP BY' in query['sql']])
+
+        # Grades stored by another process do not bump versions in this one.
+        Answer.objects.filter(task=self.task, creator=self.superuser).update(grade=0, edited=timezone.now())
+        self.assertEqual(client.get(url).data['tasks'][0]['correct'], 0)
+        Answer.objects.filter(task=self.task, creator=self.superuser).update(grade=None, edited=timezone.now())
+
+        student = User.objects.create_user('statistics_student', 'statistics@student.com', 'TajneHaslo')
+        Answer.objects.create(task=self.task, creator=student, choice_answer=True, solution=self.solution,
+                              submit=True)
+        other_student = User.objects.create_user('statistics_other', 'statistics@other.com', 'TajneHaslo')
+        Answer.objects.create(task=self.task, creator=other_student, choice_answer=False, solution=self.solution,
+                              submit=True)
+        task = client.get(url).data['tasks'][0]
+        self.assertEqual((task['answers'], task['respondents'], task['correct'], task['percent_correct']),
+                         (4, 3, 2, 66.67))
+        self.assertEqual([(solution['picks'], solution['pick_rate']) for solution in task['solutions']],
+                         [(2, 66.67), (1, 33.33)])
+
+        exam = self.exam_sheet.get_or_create_instance(student)[0]
+        client.force_authenticate(student)
+        response = client.get(f'/exam_sheets/{exam.pk}/statistics/')
+        self.assertEqual(response.status_code, 200)
+        task = response.data['tasks'][0]
+        self.assertEqual((task['answers'], task['respondents'], task['correct']), (1, 1, 1))
+        self.assertEqual([(solution['picks'], solution['pick_rate']) for solution in task['solutions']],
+                         [(1, 100.0), (0, 0.0)])
+
 
 class TestPermissions(APISimpleTestCase):
     allow_database_queries = True
@@ -339,3 +817,288 @@ class TestPermissions(APISimpleTestCase):
 
         status_code = self.client.get(f'{self.exam_list_url}{response.data["id"]}/').status_code
         self.assertEqual(status_code, 200)
+
+    def test_malformed_ids_are_not_found(self):
+        self.client.force_authenticate(self.superuser)
+        for url in ('/exam_sheets/abc/', '/tasks/abc/', '/solutions/abc/', '/answers/abc/', '/grading_jobs/abc/',
+                    '/exam_sheets/abc/statistics/'):
+            self.assertEqual(self.client.get(url).status_code, 404, url)
+        for url in ('/exam_sheets/abc/regrade/', '/solutions/abc/regrade/'):
+            self.assertEqual(self.client.post(url).status_code, 404, url)
+
+
+class TestQueryPlans(APISimpleTestCase):
+    allow_database_queries = True
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser('adminadmin',
+                                                       'adminadmin@admin.com',
+                                                       'TajneHaslo',
+                                                       id=12,
+                                                       first_name='Test',
+                                                       last_name='Nazwisko')
+        self.exam_list_url = '/exam_sheets/'
+        self.templates_list_url = '/exam_sheets/templates/'
+        self.task_list_url = '/tasks/'
+        self.client = APIClient()
+        self.client.force_authenticate(self.superuser)
+
+    def _create_template(self, tasks_amount=2):
+        exam_sheet = ExamSheet.objects.create(template=True,
+                                              name='template',
+                                              creator=self.superuser)
+        for _ in range(tasks_amount):
+            task = Task.objects.create(type='MULTI_CHOICE',
+                                       creator=self.superuser)
+            task.exam_sheet.add(exam_sheet)
+            solution = Solution.objects.create(task=task,
+                                               text_answer='answer',
+                                               points=5,
+                                               creator=self.superuser,
+                                               choice_answer=True)
+            Answer.objects.create(task=task,
+                                  creator=self.superuser,
+                                  choice_answer=True,
+                                  solution=solution,
+                                  submit=True)
+        return exam_sheet
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_queries_do_not_grow(self):
+        self._create_template()
+        exam_queries = self._count_queries(self.exam_list_url)
+        task_queries = self._count_queries(self.task_list_url)
+        self._create_template(tasks_amount=5)
+        self.assertEqual(self._count_queries(self.exam_list_url), exam_queries)
+        self.assertEqual(self._count_queries(self.task_list_url), task_queries)
+
+    def test_detail_queries_do_not_grow(self):
+        small = self._create_template(tasks_amount=1)
+        big = self._create_template(tasks_amount=6)
+        self.assertEqual(self._count_queries(f'{self.exam_list_url}{big.pk}/'),
+                         self._count_queries(f'{self.exam_list_url}{small.pk}/'))
+
+    def test_cached_template(self):
+        exam_sheet = self._create_template(tasks_amount=2)
+        url = f'{self.exam_list_url}{exam_sheet.pk}/'
+        self.client.get(url)
+        self.assertEqual(self._count_queries(url), 1)
+
+        # Grades stored by another process do not bump versions in this one.
+        answer = Answer.objects.filter(task__exam_sheet=exam_sheet).first()
+        Answer.objects.filter(pk=answer.pk).update(grade=1, edited=timezone.now())
+        grades = [answer['grade'] for task in self.client.get(url).data['tasks']
+                  for solution in task['related_solutions'] for answer in solution['answer']]
+        self.assertIn(1, grades)
+
+        solution = Solution.objects.filter(task__exam_sheet=exam_sheet).first()
+        solution.points = 9
+        solution.save()
+        response = self.client.get(url)
+        points = [solution['points'] for task in response.data['tasks'] for solution in task['related_solutions']]
+        self.assertIn(9, points)
+
+        Task.objects.create(type='TEXT', creator=self.superuser).exam_sheet.add(exam_sheet)
+        self.assertEqual(len(self.client.get(url).data['tasks']), 3)
+
+        cached = self.client.get(url)
+        other_template = ExamSheet.objects.create(template=True, name='other', creator=self.superuser)
+        solution.task.exam_sheet.add(other_template)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=cached['ETag']).status_code, 200)
+        response = self.client.get(url)
+        self.assertIn({exam_sheet.pk, other_template.pk},
+                      [set(task['exam_sheet']) for task in response.data['tasks']])
+
+    def test_cached_templates_list(self):
+        exam_sheet = self._create_template()
+        self.client.get(self.templates_list_url)
+        self.assertEqual(self._count_queries(self.templates_list_url), 2)
+
+        ExamSheet.objects.filter(pk=exam_sheet.pk).update(name='renamed elsewhere', edited=timezone.now())
+        names = [exam['name'] for exam in self.client.get(self.templates_list_url).data['results']]
+        self.assertIn('renamed elsewhere', names)
+
+    def test_conditional_get(self):
+        for template in (False, True):
+            exam_sheet = self._create_template()
+            ExamSheet.objects.filter(pk=exam_sheet.pk).update(template=template)
+            url = f'{self.exam_list_url}{exam_sheet.pk}/'
+            response = self.client.get(url)
+            self.assertIn('Last-Modified', response)
+
+            with CaptureQueriesContext(connection) as context:
+                not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertLessEqual(len(context.captured_queries), 2)
+
+            answer = Answer.objects.filter(task__exam_sheet=exam_sheet).first()
+            answer.submit = False
+            answer.save()
+            modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(modified.status_code, 200)
+            self.assertNotEqual(modified['ETag'], response['ETag'])
+            self.assertEqual(modified['Last-Modified'], http_date(answer.edited.timestamp()))
+
+    def test_freshness_does_not_grow_with_cohort(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Counts steps of the SQLite virtual machine')
+        exam_sheet = self._create_template(tasks_amount=2)
+        solutions = list(Solution.objects.filter(task__exam_sheet=exam_sheet))
+        request = Request(RequestFactory().get('/'))
+        request.user = self.superuser
+        view = ExamSheetViewSet(request=request, action='retrieve', kwargs={}, format_kwarg=None)
+
+        def freshness_steps(students):
+            for number in range(students):
+                student = User.objects.create_user(f'cohort_{students}_{number}', 'cohort@student.com', 'TajneHaslo')
+                exam_sheet.get_or_create_instance(student)
+                Answer.objects.bulk_create([Answer(task_id=solution.task_id, solution=solution, creator=student,
+                                                   submit=True) for solution in solutions])
+            steps = []
+
+            def count_steps():
+                steps.append(1)
+                return 0
+
+            connection.connection.set_progress_handler(count_steps, 10)
+            try:
+                view.get_freshness(ExamSheet.objects.filter(pk=exam_sheet.pk))
+            finally:
+                connection.connection.set_progress_handler(None, 0)
+            return len(steps)
+
+        small = freshness_steps(4)
+        # Four times the students, answers and exam instances linking the same tasks.
+        self.assertLess(freshness_steps(12), 6 * small)
+
+    def test_conditional_get_follows_visible_task_links(self):
+        template = self._create_template(tasks_amount=1)
+        student = User.objects.create_user('linked_student', 'linked@student.com', 'TajneHaslo')
+        exam, _ = template.get_or_create_instance(student)
+        url = f'{self.exam_list_url}{exam.pk}/'
+        self.client.force_authenticate(student)
+        response = self.client.get(url)
+
+        other_student = User.objects.create_user('linked_other', 'linked@other.com', 'TajneHaslo')
+        template.get_or_create_instance(other_student)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        other_template = ExamSheet.objects.create(template=True, name='linked', creator=self.superuser)
+        template.tasks.get().exam_sheet.add(other_template)
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(modified.status_code, 200)
+        self.assertEqual(set(modified.data['tasks'][0]['exam_sheet']), {template.pk, exam.pk, other_template.pk})
+
+    def test_conditional_list(self):
+        response = self.client.get(self.task_list_url)
+        self.assertEqual(self.client.get(self.task_list_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self._create_template(tasks_amount=1)
+        self.assertEqual(self.client.get(self.task_list_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_sparse_fieldsets(self):
+        exam_sheet = self._create_template(tasks_amount=3)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.exam_list_url, {'fields': 'id,name', 'page_size': 1000})
+        self.assertEqual(set(response.data['results'][0]), {'id', 'name'})
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertFalse([query for query in context.captured_queries if 'sheets_task' in query['sql']])
+
+        url = f'{self.exam_list_url}{exam_sheet.pk}/'
+        for _ in range(2):
+            response = self.client.get(url, {'fields': 'name,tasks.question,tasks.related_solutions',
+                                             'expand': 'tasks'})
+            self.assertEqual(set(response.data), {'name', 'tasks'})
+            self.assertEqual(set(response.data['tasks'][0]), {'question', 'related_solutions'})
+            self.assertIsInstance(response.data['tasks'][0]['related_solutions'][0], int)
+        response = self.client.get(url)
+        self.assertIsInstance(response.data['tasks'][0]['related_solutions'][0], dict)
+
+
+class TestBenchmarkCommands(APISimpleTestCase):
+    allow_database_queries = True
+
+    def test_seed_and_benchmark(self):
+        start_amount = Answer.objects.all().count()
+        call_command('seed_data', users=4, templates=2, tasks=3, solutions=2, exams=1, stdout=StringIO())
+        self.assertEqual(Answer.objects.all().count(), start_amount + 4 * 3 * 2)
+
+        output = StringIO()
+        call_command('benchmark_api', repeat=2, stdout=output)
+        self.assertIn('POST /answers/bulk/', output.getvalue())
+        self.assertEqual(Answer.objects.all().count(), start_amount + 4 * 3 * 2)
+
+        output = StringIO()
+        call_command('benchmark_rendering', repeat=1, limit=2, stdout=output)
+        self.assertIn('serialize (fast path)', output.getvalue())
+
+        output = StringIO()
+        call_command('benchmark_concurrency', workers=1, requests=2, profiles=['rollback', 'tuned'], stdout=output)
+        self.assertEqual([line.split()[0] for line in output.getvalue().splitlines()[1:]], ['rollback', 'tuned'])
+        self.assertEqual(Answer.objects.all().count(), start_amount + 4 * 3 * 2)
+
+
+class TestDatabaseRouting(APISimpleTestCase):
+    allow_database_queries = True
+
+    def test_read_only_actions_use_replicas(self):
+        router = ReadReplicaRouter()
+        with mock.patch('sheets.db.healthy_replicas', return_value=['replica_0', 'replica_1']) as healthy_replicas:
+            self.assertEqual(router.db_for_read(ExamSheet), 'default')
+            db.set_replica_reads(True)
+            try:
+                replica = router.db_for_read(ExamSheet)
+                self.assertIn(replica, ('replica_0', 'replica_1'))
+                self.assertEqual({router.db_for_read(model) for model in (ExamSheet, Task, Answer) * 10}, {replica})
+                with db.primary():
+                    self.assertEqual(router.db_for_read(ExamSheet), 'default')
+                self.assertEqual(router.db_for_read(ExamSheet), replica)
+                self.assertEqual(router.db_for_write(ExamSheet), 'default')
+            finally:
+                db.set_replica_reads(False)
+            self.assertEqual(healthy_replicas.call_count, 1)
+            self.assertEqual(router.db_for_read(ExamSheet), 'default')
+
+        superuser = User.objects.create_superuser('adminadmin', 'adminadmin@admin.com', 'TajneHaslo', id=12)
+        client = APIClient()
+        client.force_authenticate(superuser)
+        with mock.patch('sheets.db.set_replica_reads', wraps=db.set_replica_reads) as set_replica_reads:
+            client.get('/exam_sheets/')
+            client.post('/exam_sheets/', {'name': 'routing', 'template': True})
+        self.assertEqual([call[0][0] for call in set_replica_reads.call_args_list], [True, False, False, False])
+
+
+class TestInstrumentation(APISimpleTestCase):
+    allow_database_queries = True
+
+    def setUp(self):
+        self.superuser = User.objects.create_superuser('adminadmin',
+                                                       'adminadmin@admin.com',
+                                                       'TajneHaslo',
+                                                       id=12,
+                                                       first_name='Test',
+                                                       last_name='Nazwisko')
+
+    @override_settings(SHEETS_INSTRUMENTATION=True)
+    def test_request_stats(self):
+        client = APIClient()
+        client.force_authenticate(self.superuser)
+        registry.reset()
+        with self.assertLogs('sheets.instrumentation', 'INFO') as logs:
+            response = client.get('/exam_sheets/')
+            stats_response = client.get('/instrumentation/stats/')
+
+        self.assertEqual(response['X-View'], 'ExamSheetViewSet.list')
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertEqual(int(response['X-Response-Size']), len(response.content))
+        self.assertEqual(json.loads(logs.records[0].getMessage())['action'], 'list')
+        self.assertEqual(stats_response.data['ExamSheetViewSet.list']['requests'], 1)
+
+    def test_disabled_by_default(self):
+        client = APIClient()
+        client.force_authenticate(self.superuser)
+        self.assertNotIn('X-Query-Count', client.get('/exam_sheets/'))
@@ -1,23 +1,236 @@
+import calendar
+import datetime
+import hashlib
+import io
+
+from django.db.models import Count, DateTimeField, Max, OuterRef, Prefetch, Q, Subquery, prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import cached_property
+from django.utils.http import http_date
 from django_filters import rest_framework as dfilters
-from rest_framework import viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
+from rest_framework.generics import get_object_or_404
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from url_filter.integrations.drf import DjangoFilterBackend
 
-from sheets.models import ExamSheet, Task, Answer, Solution
+from sheets import db, grading
+from sheets.cache import exam_sheet_versions, get_exam_sheets, set_exam_sheets
+from sheets.exports import CONTENT_TYPES, export_results
+from sheets.importers import import_template, parse_template_csv
+from sheets.instrumentation import registry
+from sheets.models import ExamSheet, Task, Answer, Solution, GradingJob
 from sheets.permissions import IsObjectOwnerPermissions
-from sheets.serializers import ExamSheetSerializer, TaskSerializer, AnswerSerializer, SolutionSerializer
+from sheets.policies import is_unrestricted, visible_answers, visible_exam_sheets, visible_grades, \
+    visible_grading_jobs, visible_solutions, visible_tasks
+from sheets.renderers import FastJSONRenderer
+from sheets.serializers import ExamSheetSerializer, TaskSerializer, AnswerSerializer, SolutionSerializer, \
+    BulkAnswerSerializer, GradingJobSerializer
+from sheets.sparse import SparseFieldset
+from sheets.statistics import exam_sheet_statistics, exam_sheet_statistics_stamp
 
 
 class BaseViewSet(viewsets.ModelViewSet):
     serializers = {
         'default': None,
     }
+    select_related = ()
+    prefetch_related = ()
+    policy = None
+    scoped_prefetches = {}
+    replica_actions = ('list', 'retrieve', 'exams', 'templates')
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        db.set_replica_reads(self.action in self.replica_actions)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        db.set_replica_reads(False)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    @cached_property
+    def sparse_fieldset(self):
+        """
+        Fields and nested serializers a reading client asked for, `None` renders everything.
+        """
+        if self.request is None or self.request.method not in ('GET', 'HEAD'):
+            return None
+        return SparseFieldset.from_request(self.request)
+
+    def get_prefetch_related(self):
+        """
+        Return the declared prefetches, with nested rows limited to those the user may see.
+        """
+        return tuple(Prefetch(lookup, queryset=self.scoped_prefetches[lookup](self.request.user))
+                     if lookup in self.scoped_prefetches else lookup
+                     for lookup in self.prefetch_related)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.policy is not None:
+            queryset = self.policy(self.request.user, queryset)
+        prefetch_related = self.get_prefetch_related()
+        if self.sparse_fieldset is not None:
+            prefetch_related = self.sparse_fieldset.prune_prefetches(prefetch_related)
+        return queryset.select_related(*self.select_related).prefetch_related(*prefetch_related)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['sparse_fieldset'] = self.sparse_fieldset
+        return context
+
+    freshness_lookups = ('edited',)
+    freshness_counts = ()
+    freshness_rows = None
+
+    def get_freshness(self, queryset):
+        """
+        Return a strong ETag and the last modification time of rows in `queryset` and their nested children.
+        """
+        self.freshness_rows = self.get_freshness_rows(queryset)
+        return self.get_rows_freshness(self.freshness_rows)
+
+    def get_freshness_rows(self, queryset):
+        """
+        Return a tuple per row of `queryset` in primary key order, holding the primary key, modification times
+        and counts of nested children that its representation shows to the user.
+
+        Each nested relation is counted and dated by its own subquery per row, so rows of one relation are never
+        multiplied by rows of another and the cost follows the rows of `queryset`, e.g. one page.
+        """
+        counts, lookups = self.freshness_counts, self.freshness_lookups
+        if self.sparse_fieldset is not None:
+            counts = self.sparse_fieldset.prune_counts(counts)
+            lookups = self.sparse_fieldset.prune_values(lookups)
+        nested = [Count(lookup, distinct=True, filter=self.get_freshness_scope(lookup)) for lookup in counts]
+        nested += [Max(lookup, output_field=DateTimeField(), filter=self.get_freshness_scope(lookup))
+                   for lookup in lookups if '__' in lookup]
+        fields = ['pk'] + [lookup for lookup in lookups if '__' not in lookup]
+        annotations = {f'nested_{index}': self.get_relation_subquery(queryset.model, aggregate)
+                       for index, aggregate in enumerate(nested)}
+        return list(queryset.order_by('pk').prefetch_related(None).annotate(**annotations)
+                    .values_list(*fields, *annotations))
+
+    def get_rows_freshness(self, rows):
+        """
+        Return a strong ETag and the last modification time of `rows` given by `get_freshness_rows`.
+        """
+        # Nested rows are scoped per user, so are representations and their tags.
+        values = [self.request.user.pk, self.sparse_fieldset and self.sparse_fieldset.key, rows]
+        last_modified = max((value for row in rows for value in row if isinstance(value, datetime.datetime)),
+                            default=None)
+        etag = hashlib.sha1(repr(values).encode()).hexdigest()
+        return f'"{etag}"', last_modified and calendar.timegm(last_modified.utctimetuple())
+
+    def get_freshness_scope(self, lookup):
+        """
+        Return a filter limiting an aggregate over `lookup` to rows its scoped prefetch shows, `None` for all rows.
+        """
+        if is_unrestricted(self.request.user):
+            return None
+        for prefix, policy in self.scoped_prefetches.items():
+            if lookup == prefix or lookup.startswith(f'{prefix}__'):
+                return Q(**{f'{prefix}__in': policy(self.request.user).values('pk')})
+        return None
+
+    @staticmethod
+    def get_relation_subquery(model, aggregate):
+        """
+        Return `aggregate` over one relation of the outer row as a correlated subquery.
+        """
+        rows = model._default_manager.filter(pk=OuterRef('pk')).order_by().values('pk')
+        return Subquery(rows.annotate(value=aggregate).values('value'), output_field=aggregate.output_field)
+
+    def conditional_response(self, request, freshness, render):
+        etag, last_modified = freshness
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified) or render()
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.wants_stream():
+            # A tag would have to read every row before the first line is sent.
+            return self.get_list_response(queryset)
+        page = self.paginate_queryset(queryset.prefetch_related(None))
+        if page is None:
+            return self.conditional_response(request, self.get_freshness(queryset),
+                                             lambda: self.get_list_response(queryset))
+
+        def render():
+            prefetch_related_objects(page, *queryset._prefetch_related_lookups)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+        page_rows = queryset.filter(pk__in=[obj.pk for obj in page])
+        return self.conditional_response(request, self.get_freshness(page_rows), render)
+
+    def retrieve(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = get_object_or_404(queryset.prefetch_related(None), **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, instance)
+        queryset = queryset.filter(pk=instance.pk)
+
+        def render():
+            prefetch_related_objects([instance], *queryset._prefetch_related_lookups)
+            return Response(self.get_serializer(instance).data)
+
+        return self.conditional_response(request, self.get_freshness(queryset), render)
 
     def get_serializer_class(self):
         return self.serializers.get(self.action, self.serializers['default'])
 
+    def get_plain_object(self):
+        """
+        Return the requested object without running the prefetches declared for its representation.
+        """
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        instance = get_object_or_404(self.filter_queryset(self.get_queryset()).prefetch_related(None),
+                                     **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, instance)
+        return instance
+
+    def get_regrade_response(self, answers):
+        return Response({'regraded': grading.regrade(answers)})
+
+    def wants_stream(self):
+        return self.request.query_params.get('output') == 'ndjson'
+
+    stream_chunk_size = 100
+
+    def stream_ndjson(self, queryset):
+        """
+        Yield a JSON line per object of `queryset` in primary key order, reading `stream_chunk_size` objects
+        after the last one sent at a time, so memory does not grow with the table.
+        """
+        renderer = FastJSONRenderer()
+        queryset = queryset.order_by('pk')
+        objects = list(queryset[:self.stream_chunk_size])
+        while objects:
+            for data in self.get_serializer(objects, many=True).data:
+                yield renderer.render(data) + b'\n'
+            if len(objects) < self.stream_chunk_size:
+                return
+            objects = list(queryset.filter(pk__gt=objects[-1].pk)[:self.stream_chunk_size])
+
+    def get_list_response(self, queryset):
+        if self.wants_stream():
+            return StreamingHttpResponse(self.stream_ndjson(queryset), content_type=CONTENT_TYPES['ndjson'])
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
     def perform_create(self, serializer):
         serializer.save(creator=self.request.user)
 
@@ -29,24 +242,110 @@ class ExamSheetViewSet(BaseViewSet):
     queryset = ExamSheet.objects.all()
     serializers = {
         'default': ExamSheetSerializer, }
+    prefetch_related = ('tasks__exam_sheet', 'tasks__related_solutions__answer')
+    policy = staticmethod(visible_exam_sheets)
+    scoped_prefetches = {
+        'tasks__exam_sheet': visible_exam_sheets,
+        'tasks__related_solutions__answer': visible_answers,
+    }
+    freshness_lookups = ('edited', 'tasks__edited', 'tasks__related_solutions__edited',
+                         'tasks__related_solutions__answer__edited')
+    freshness_counts = ('tasks', 'tasks__exam_sheet', 'tasks__related_solutions', 'tasks__related_solutions__answer')
     permission_classes = (IsObjectOwnerPermissions,)
     filter_backends = (DjangoFilterBackend, OrderingFilter, dfilters.DjangoFilterBackend)
 
-    filter_fields = ('creator', 'template')
+    filter_fields = ('creator', 'template', 'task_count', 'max_score')
 
-    ordering_fields = ('creator', 'name', 'created', 'template')
+    ordering_fields = ('id', 'creator', 'name', 'created', 'template', 'task_count', 'max_score')
+    ordering = ('-id',)
 
     @action(methods=['get', ], detail=False)
     def exams(self, request):
-        exams = ExamSheet.objects.filter(template=False)
-        serializer = self.get_serializer(exams, many=True)
-        return Response(serializer.data)
+        return self.get_list_response(self.filter_queryset(self.get_queryset()).filter(template=False))
+
+    def get_cache_part(self, part):
+        """
+        Name the cached `part` of rendered sheets after the user, whose rows and final grade they show,
+        and the fields asked for.
+        """
+        if self.sparse_fieldset is None:
+            return f'{part}:{self.request.user.pk}'
+        return f'{part}:{self.request.user.pk}:{self.sparse_fieldset.key}'
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs['pk']
+        versions = exam_sheet_versions([pk])
+        cached = get_exam_sheets(versions, self.get_cache_part('data')).get(pk)
+        if cached is not None:
+            row, data = cached
+            # Other processes change rows without bumping versions in this cache, renders are kept while
+            # the freshness row they were rendered at is current.
+            if self.get_freshness_rows(self.filter_queryset(self.get_queryset()).filter(pk=row[0])) == [row]:
+                return self.conditional_response(request, self.get_rows_freshness([row]), lambda: Response(data))
+        # Replicas may lag behind the version bump, renders that get cached are read from the primary.
+        with db.primary():
+            response = super().retrieve(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        if 'template' in response.data:
+            template = response.data['template']
+        else:
+            template = ExamSheet.objects.filter(pk=pk, template=True).exists()
+        if template:
+            set_exam_sheets(versions, {pk: (self.freshness_rows[0], response.data)}, self.get_cache_part('data'))
+        return response
 
     @action(methods=['get', ], detail=False)
     def templates(self, request):
-        exams = ExamSheet.objects.filter(template=True)
-        serializer = self.get_serializer(exams, many=True)
-        return Response(serializer.data)
+        queryset = self.filter_queryset(self.get_queryset()).filter(template=True)
+        if self.wants_stream():
+            return self.get_list_response(queryset)
+        page = self.paginate_queryset(queryset.prefetch_related(None))
+        if page is None:
+            return self.get_list_response(queryset)
+        pks = [exam.pk for exam in page]
+        versions = exam_sheet_versions(pks)
+        rows = {row[0]: row for row in self.get_freshness_rows(queryset.filter(pk__in=pks))}
+        data = {pk: rendered for pk, (row, rendered) in get_exam_sheets(versions, self.get_cache_part('data')).items()
+                if rows.get(pk) == row}
+        missing = [exam.pk for exam in page if exam.pk not in data]
+        if missing:
+            with db.primary():
+                exams = queryset.in_bulk(missing)
+            serializer = self.get_serializer([exams[pk] for pk in missing], many=True)
+            rendered = dict(zip(missing, serializer.data))
+            # Rows read before rendering are never newer than the render, a change in between shows next time.
+            set_exam_sheets(versions, {pk: (rows[pk], exam) for pk, exam in rendered.items() if pk in rows},
+                            self.get_cache_part('data'))
+            data.update(rendered)
+        return self.get_paginated_response([data[exam.pk] for exam in page])
+
+    @action(methods=['post', ], detail=True)
+    def regrade(self, request, pk=None):
+        return self.get_regrade_response(self.get_plain_object().get_answers())
+
+    @action(methods=['get', ], detail=True)
+    def statistics(self, request, pk=None):
+        exam_sheet = self.get_plain_object()
+        versions = exam_sheet_versions([exam_sheet.pk])
+        stamp = exam_sheet_statistics_stamp(exam_sheet)
+        cached = get_exam_sheets(versions, 'statistics').get(exam_sheet.pk)
+        if cached is not None and cached[0] == stamp:
+            return Response(cached[1])
+        data = exam_sheet_statistics(exam_sheet)
+        set_exam_sheets(versions, {exam_sheet.pk: (stamp, data)}, 'statistics')
+        return Response(data)
+
+    @action(methods=['post', ], detail=False, url_path='import')
+    def import_template(self, request):
+        if 'file' in request.FILES:
+            lines = io.StringIO(request.FILES['file'].read().decode('utf-8'), newline='')
+            document = parse_template_csv(lines, request.data.get('name'))
+        else:
+            document = request.data
+        exam_sheet = import_template(document, request.user)
+        serializer = self.get_serializer(self.get_queryset().get(pk=exam_sheet.pk))
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 class TaskViewSet(BaseViewSet):
@@ -54,6 +353,14 @@ class TaskViewSet(BaseViewSet):
     serializers = {
         'default': TaskSerializer,
     }
+    prefetch_related = ('exam_sheet', 'related_solutions__answer')
+    policy = staticmethod(visible_tasks)
+    scoped_prefetches = {
+        'exam_sheet': visible_exam_sheets,
+        'related_solutions__answer': visible_answers,
+    }
+    freshness_lookups = ('edited', 'related_solutions__edited', 'related_solutions__answer__edited')
+    freshness_counts = ('exam_sheet', 'related_solutions', 'related_solutions__answer')
     permission_classes = (IsObjectOwnerPermissions,)
 
 
@@ -62,11 +369,74 @@ class SolutionViewSet(BaseViewSet):
     serializers = {
         'default': SolutionSerializer,
     }
+    prefetch_related = ('answer',)
+    policy = staticmethod(visible_solutions)
+    scoped_prefetches = {
+        'answer': visible_answers,
+    }
+    freshness_lookups = ('edited', 'answer__edited')
+    freshness_counts = ('answer',)
     permission_classes = (IsObjectOwnerPermissions,)
 
+    @action(methods=['post', ], detail=True)
+    def regrade(self, request, pk=None):
+        return self.get_regrade_response(Answer.objects.filter(solution=self.get_plain_object()))
+
 
 class AnswerViewSet(BaseViewSet):
     queryset = Answer.objects.all()
     serializers = {
         'default': AnswerSerializer,
+        'bulk': BulkAnswerSerializer,
+    }
+    select_related = ('solution__task',)
+    policy = staticmethod(visible_answers)
+
+    @action(methods=['post', ], detail=False)
+    def bulk(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        answers = AnswerSerializer(serializer.save(), many=True, context=self.get_serializer_context())
+        return Response(answers.data, status=status.HTTP_201_CREATED)
+
+    @action(methods=['get', ], detail=False)
+    def export(self, request):
+        results = request.query_params.get('type', 'answers')
+        output = request.query_params.get('output', 'ndjson')
+        if results not in ('answers', 'grades') or output not in CONTENT_TYPES:
+            raise ValidationError('Supported types are answers and grades, outputs are csv and ndjson')
+        exam_sheet = request.query_params.get('exam_sheet')
+        if exam_sheet is not None:
+            try:
+                exam_sheet = int(exam_sheet)
+            except ValueError:
+                raise ValidationError({'exam_sheet': ['A valid integer is required.']})
+        lines = export_results(results, output,
+                               exam_sheet=exam_sheet,
+                               answers=self.get_queryset(),
+                               grades=visible_grades(request.user))
+        response = StreamingHttpResponse(lines, content_type=CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="{results}.{output}"'
+        return response
+
+
+class GradingJobViewSet(BaseViewSet):
+    queryset = GradingJob.objects.all()
+    serializers = {
+        'default': GradingJobSerializer,
     }
+    http_method_names = ('get', 'head', 'options')
+    filter_fields = ('answer', 'status')
+    policy = staticmethod(visible_grading_jobs)
+    freshness_lookups = ('started', 'finished')
+
+
+class InstrumentationStatsView(APIView):
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response(registry.snapshot())
+
+    def delete(self, request):
+        registry.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)